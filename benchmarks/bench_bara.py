@@ -0,0 +1,223 @@
+"""Benchmarks of `capybara bara` on synthetic inputs.
+
+Every case compares a reference file with a candidate that has a shifted
+leaf and shuffled events, so that the sorting, KS and Anderson-Darling code
+paths are exercised alongside the fast path for identical leaves. Cases
+without differences fail unless every leaf matches, e.g. a TTree and an
+RNTuple holding the same events. Inputs
+are generated once and cached. Each run happens in a fresh process, which
+reports the time spent in every phase of `bara` and its peak RSS.
+
+    python benchmarks/bench_bara.py --output before.json
+    # ... change something ...
+    python benchmarks/bench_bara.py --baseline before.json
+
+With --baseline, the exit status is non-zero if a case regressed.
+"""
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import click
+
+from epic_capybara.cli.bara import bara
+from epic_capybara.profiling import Profiler, activate
+from epic_capybara.synthetic import DEFAULT_COLLECTIONS, generate_events, write_events
+from epic_capybara.util import get_cache_dir
+
+
+_DIFFERENCES = {"MCParticles.momentum.x": 0.05}
+
+CASES = {
+    "default": {"n_events": 20000},
+    "high-multiplicity": {
+        "n_events": 2000,
+        "multiplicity": 200,
+        "collections": {"EcalBarrelHits": {"energy": "float32", "position.x": "float32", "cellID": "uint32"}},
+        "differences": {"EcalBarrelHits.energy": 0.05},
+    },
+    "wide": {
+        "n_events": 2000,
+        "collections": {
+            f"{collection_name}{ix}": leaves
+            for ix in range(10)
+            for collection_name, leaves in DEFAULT_COLLECTIONS.items()
+        },
+        "differences": {"MCParticles0.momentum.x": 0.05},
+    },
+    # the same events in baskets of 200, read one at a time into quantile
+    # sketches
+    "high-multiplicity-sketch": {
+        "n_events": 2000,
+        "multiplicity": 200,
+        "collections": {"EcalBarrelHits": {"energy": "float32", "position.x": "float32", "cellID": "uint32"}},
+        "differences": {"EcalBarrelHits.energy": 0.05},
+        "cluster_size": 200,
+        "options": ["--sketch-size", "8192"],
+    },
+    "rntuple": {"n_events": 20000, "format": "rntuple", "cluster_size": 2000},
+    # the same events as a TTree and as a shuffled RNTuple with several
+    # clusters: every leaf must match
+    "mixed": {"n_events": 20000, "format": ["ttree", "rntuple"], "cluster_size": 2000, "differences": {}},
+}
+
+# Changed whenever epic_capybara.synthetic writes different files, so that
+# cached inputs are generated again
+_INPUTS_VERSION = 2
+
+# Phases shorter than this are not reported as regressions, their timings
+# are dominated by noise
+_MIN_SECONDS = 0.05
+
+
+def _inputs(case, data_dir):
+    """Return the paths of the reference and candidate files of a case,
+    generating them if needed."""
+    # options of bara do not change the inputs
+    params = {name: value for name, value in CASES[case].items() if name != "options"}
+    tag = hashlib.blake2b(json.dumps([_INPUTS_VERSION, params], sort_keys=True).encode(), digest_size=8).hexdigest()
+    formats = params.pop("format", "ttree")
+    if isinstance(formats, str):
+        formats = [formats, formats]
+    cluster_size = params.pop("cluster_size", None)
+    differences = params.pop("differences", _DIFFERENCES)
+    paths = []
+    for name, format, kwargs in [
+            ("reference", formats[0], {}),
+            ("candidate", formats[1], {"differences": differences, "shuffle": True}),
+    ]:
+        path = os.path.join(data_dir, f"{case}-{tag}", name, "events.root")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_events(path + ".tmp", generate_events(**params, **kwargs), format=format, cluster_size=cluster_size)
+            os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+def run_case(case, data_dir):
+    """Run `bara` on a case in this process and return its measurements."""
+    paths = _inputs(case, data_dir)
+    profiler = Profiler()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with activate(profiler), redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                summary = bara.main([*paths, "-j", "1", *CASES[case].get("options", [])], standalone_mode=False)
+                total = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    if CASES[case].get("differences") == {}:
+        mismatched = sorted(
+            collection_name for collection_name, collection in summary.items()
+            if collection["n_match"] != collection["n_plots"]
+        )
+        if mismatched:
+            raise RuntimeError(f"Identical inputs of case \"{case}\" differ in {', '.join(mismatched)}")
+    try:
+        import resource
+    except ImportError:
+        peak_rss = None
+    else:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        if sys.platform != "darwin":
+            peak_rss *= 1024
+    return {
+        "total": total,
+        "phases": {name: stats["wall"] for name, stats in sorted(profiler.phases.items())},
+        "peak_rss": peak_rss,
+    }
+
+
+def _measure(case, data_dir, repeat):
+    """Run a case `repeat` times in fresh processes, keep the best run."""
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, __file__, "--run-case", case, "--data-dir", data_dir],
+            check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        if best is None:
+            best = result
+            continue
+        best["total"] = min(best["total"], result["total"])
+        for name, seconds in result["phases"].items():
+            best["phases"][name] = min(best["phases"].get(name, seconds), seconds)
+        if result["peak_rss"] is not None:
+            best["peak_rss"] = min(best["peak_rss"], result["peak_rss"])
+    return best
+
+
+def _compare(results, baseline, threshold):
+    """Print a comparison table and return the list of regressions."""
+    regressions = []
+    for case, result in results.items():
+        old = baseline.get(case)
+        if old is None:
+            continue
+        rows = [("total", old["total"], result["total"])]
+        rows += [
+            (name, old["phases"].get(name), seconds)
+            for name, seconds in result["phases"].items()
+        ]
+        for name, before, after in rows:
+            if before is None:
+                continue
+            ratio = after / before if before > 0 else float("inf")
+            regressed = ratio > 1 + threshold and after - before > _MIN_SECONDS
+            click.echo(f"{case:>20} {name:>10} {before:9.3f}s {after:9.3f}s {ratio:6.2f}x" + (" REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((case, name))
+        if old.get("peak_rss") and result.get("peak_rss"):
+            ratio = result["peak_rss"] / old["peak_rss"]
+            regressed = ratio > 1 + threshold
+            click.echo(f"{case:>20} {'peak RSS':>10} {old['peak_rss'] / 2**20:8.1f}M {result['peak_rss'] / 2**20:8.1f}M {ratio:6.2f}x" + (" REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((case, "peak_rss"))
+    return regressions
+
+
+@click.command()
+@click.option("--case", "cases", multiple=True, type=click.Choice(sorted(CASES)), help="Cases to run (defaults to all)")
+@click.option("--repeat", type=int, default=3, help="Number of runs per case, the fastest is kept")
+@click.option("--data-dir", default=str(get_cache_dir() / "benchmarks"), help="Directory for the generated inputs")
+@click.option("--output", type=click.Path(dir_okay=False), help="Store the results as JSON")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), help="Compare against results stored with --output")
+@click.option("--threshold", type=float, default=0.2, help="Relative slowdown reported as a regression")
+@click.option("--run-case", "case_to_run", hidden=True)
+def main(cases, repeat, data_dir, output, baseline, threshold, case_to_run):
+    if case_to_run is not None:
+        print(json.dumps(run_case(case_to_run, data_dir)))
+        return
+
+    results = {}
+    for case in cases or sorted(CASES):
+        # generate inputs outside of the measured runs
+        _inputs(case, data_dir)
+        results[case] = _measure(case, data_dir, repeat)
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in results[case]["phases"].items())
+        click.echo(f"{case}: {results[case]['total']:.2f}s ({phases})", err=True)
+
+    if output is not None:
+        with open(output, "w") as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        with open(baseline) as fp:
+            regressions = _compare(results, json.load(fp), threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ from ..__about__ import __version__
 from .capy import capy
 from .bara import bara
 from .cate import cate
+from .daemon import daemon
+from .trend import trend
 
 @click.group(context_settings={'help_option_names': ['-h', '--help']}, invoke_without_command=False)
 @click.version_option(version=__version__, prog_name='capybara')
@@ -17,3 +19,5 @@ def capybara(ctx: click.Context):
 capybara.add_command(capy)
 capybara.add_command(bara)
 capybara.add_command(cate)
+capybara.add_command(daemon)
+capybara.add_command(trend)
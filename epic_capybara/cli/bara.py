@@ -1,22 +1,27 @@
-import gzip
+import hashlib
 import os
 import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from functools import reduce
+from itertools import islice, takewhile
 
 import awkward as ak
 import click
 import numpy as np
 import uproot
-from bokeh.events import DocumentReady
-from bokeh.io import curdoc
-from bokeh.layouts import gridplot
-from bokeh.models import ColumnDataSource
-from bokeh.models import CustomJSExpr
-from bokeh.models import Range1d
-from bokeh.models import PrintfTickFormatter
-from bokeh.plotting import figure, output_file, save
 from hist import Hist
 from scipy.stats import PermutationMethod, anderson_ksamp, kstest
 
+from ..incremental import code_version, load_manifest, remove_manifest, save_manifest, update_leaf_digest
+from ..profiling import Profiler, activate, phase, register_counter
+from ..render import option_label, render_collections, to_filename, write_index
+from ..report import DOCUMENT_SUFFIXES, DirectoryWriter, PackWriter
+from ..serve import serve as serve_report
+from ..sketch import QuantileSketch, ad_pvalue as sketch_ad_pvalue, ks_pvalue as sketch_ks_pvalue
+from ..trend import TrendStore, leaf_statistics
 from ..util import skip_common_prefix
 
 # Cap Anderson-Darling sample size to keep runtime bounded on
@@ -33,17 +38,9 @@ def _ad_rng(key):
     processed collections changes (e.g. under different match/unmatch
     filters).
     """
-    import hashlib
     digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
     return np.random.default_rng(int.from_bytes(digest, "little"))
 
-_MIDPOINT_EXPR_CODE = """
-const y1 = this.data.y1;
-const y2 = this.data.y2;
-return y1.map((v, i) => (v + y2[i]) / 2);
-"""
-
-
 def _is_leaf(obj):
     """Check if an uproot branch/field object is a leaf (has no sub-branches/sub-fields).
 
@@ -98,519 +95,1056 @@ def match_filter(key, match, unmatch):
     return accept
 
 
-@click.command()
-@click.argument("files", type=click.File('rb'), nargs=-1)
-@click.option(
-    "-m", "--match", multiple=True,
-    help="Only include collections with names matching a regex"
-)
-@click.option(
-    "-M", "--unmatch", multiple=True,
-    help="Exclude collections with names matching a regex"
-)
-@click.option(
-    "--serve", is_flag=True,
-    default=False,
-    help="Run a local HTTP server to view the report"
-)
-def bara(files, match, unmatch, serve):
-    arr = {}
+def _min_pvalue(a, b):
+    """Return the smaller of two p-values, where None stands for "not compared".
 
-    match = list(map(re.compile, match))
-    unmatch = list(map(re.compile, unmatch))
+    >>> _min_pvalue(None, 0.5), _min_pvalue(0.3, None), _min_pvalue(0.3, 0.5), _min_pvalue(None, None)
+    (0.5, 0.3, 0.3, None)
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
 
-    for _file in files:
-        tree = uproot.open(_file)["events"]
-
-        sort_by_evtnum = None
-        for evtnum_key in ["EventHeader/EventHeader.eventNumber", "EventHeader.eventNumber"]:
-            if evtnum_key in tree.keys(recursive=True):
-                evtnum = tree[evtnum_key].array()
-                sort_by_evtnum = ak.argsort(ak.flatten(evtnum))
-                break
-
-        for key in tree.keys(recursive=True):
-            if not key.startswith("PARAMETERS") and _is_leaf(tree[key]):
-                normalized = _normalize_key(key)
-                if match_filter(normalized, match, unmatch):
-                    val = tree[key].array()
-                    if sort_by_evtnum is not None:
-                        val = val[sort_by_evtnum]
-                    arr.setdefault(normalized, {})[_file] = val
-
-    paths = skip_common_prefix([_file.name.split("/") for _file in files])
-    paths = skip_common_prefix([reversed(list(path)) for path in paths])
-    labels = ["/".join(reversed(list(reversed_path))) for reversed_path in paths]
-
-    collection_figs = {}
-    collection_with_diffs = {}
-    collection_ks_pvalue = {}
-    collection_ad_pvalue = {}
-    collection_matching_count = {}
-    collection_step_exprs = {}
-
-    for key in sorted(arr.keys()):
-        if any("string" in str(ak.type(a)) for a in arr[key].values()):
-            click.echo(f"String value detected for key \"{key}\". Skipping...")
-            continue
-        if any("bool" in str(ak.type(a)) for a in arr[key].values()):
-            click.echo(f"Bool value detected for key \"{key}\". Skipping...")
-            continue
-        if any(a.layout.minmax_depth[0] < 2 for a in arr[key].values()):
-            # Not possible for PODIO, here for general ROOT file support
-            print(f"Skipping non-array branch \"{key}\"")
+
+def _collection_name(key):
+    """
+    >>> _collection_name('MCParticles.momentum.x')
+    'MCParticles'
+    >>> _collection_name('EventHeader')
+    'EventHeader'
+    """
+    return key.split(".", 1)[0]
+
+
+def _catalog(tree):
+    """Return a mapping from normalized keys to tree keys for all leaves."""
+    catalog = {}
+    for key in tree.keys(recursive=True):
+        if not key.startswith("PARAMETERS") and _is_leaf(tree[key]):
+            catalog[_normalize_key(key)] = key
+    return catalog
+
+
+def _cluster_ranges(clusters, entry_stop=None):
+    """Return the (start, stop) entry ranges of RNTuple clusters, given as
+    (first entry, number of entries), up to `entry_stop`.
+
+    >>> _cluster_ranges([(0, 100), (100, 100), (200, 50)])
+    [(0, 100), (100, 200), (200, 250)]
+    >>> _cluster_ranges([(0, 100), (100, 100), (200, 50)], entry_stop=150)
+    [(0, 100), (100, 150)]
+    """
+    ranges = []
+    for first_entry, num_entries in clusters:
+        stop = first_entry + num_entries
+        if entry_stop is not None:
+            stop = min(stop, entry_stop)
+        if stop > first_entry:
+            ranges.append((first_entry, stop))
+    return ranges
+
+
+def _read_array(branch, entry_stop=None, executor=None):
+    """Read the values of a TTree branch or of an RNTuple field.
+
+    RNTuple fields are read one cluster at a time on `executor`, so that the
+    pages of different clusters are decompressed and deserialized in
+    parallel. Only the pages of the field's own columns are read, and the
+    result is the same as reading the field at once.
+    """
+    # TTree branches have no RNTuple
+    ntuple = getattr(branch, "ntuple", None)
+    if executor is None or not hasattr(ntuple, "cluster_summaries"):
+        return branch.array(entry_stop=entry_stop)
+    ranges = _cluster_ranges(
+        [(cluster.num_first_entry, cluster.num_entries) for cluster in ntuple.cluster_summaries],
+        entry_stop,
+    )
+    if len(ranges) <= 1:
+        return branch.array(entry_stop=entry_stop)
+    chunks = executor.map(
+        # the array cache of the file is not meant to be shared between threads
+        lambda entry_range: branch.array(entry_start=entry_range[0], entry_stop=entry_range[1], array_cache=None),
+        ranges,
+    )
+    return ak.concatenate(list(chunks))
+
+
+def _entry_ranges(branch, entry_stop=None):
+    """Return the (start, stop) entry ranges of the RNTuple clusters or of
+    the TTree baskets of a branch, up to `entry_stop`."""
+    ntuple = getattr(branch, "ntuple", None)
+    if hasattr(ntuple, "cluster_summaries"):
+        clusters = [(cluster.num_first_entry, cluster.num_entries) for cluster in ntuple.cluster_summaries]
+    else:
+        offsets = branch.entry_offsets
+        clusters = [(start, stop - start) for start, stop in zip(offsets[:-1], offsets[1:])]
+    return _cluster_ranges(clusters, entry_stop)
+
+
+def _read_chunks(branch, entry_stop=None, executor=None, read_ahead=1):
+    """Yield the entry range and the values of every RNTuple cluster or
+    TTree basket of a branch, in order.
+
+    With an `executor`, up to `read_ahead` chunks are read in parallel, so
+    that at most that many are held in memory besides the one yielded.
+    """
+    def read(entry_range):
+        # the array cache of the file is not meant to be shared between
+        # threads, and would hold on to the chunks
+        return branch.array(entry_start=entry_range[0], entry_stop=entry_range[1], array_cache=None)
+
+    ranges = iter(_entry_ranges(branch, entry_stop))
+    if executor is None:
+        for entry_range in ranges:
+            with phase("read"):
+                values = read(entry_range)
+            yield entry_range, values
+        return
+    pending = deque((entry_range, executor.submit(read, entry_range)) for entry_range in islice(ranges, read_ahead))
+    while pending:
+        entry_range, future = pending.popleft()
+        with phase("read"):
+            values = future.result()
+        for next_range in islice(ranges, 1):
+            pending.append((next_range, executor.submit(read, next_range)))
+        yield entry_range, values
+
+
+def _read_evtnum(branch, executor=None):
+    """Return the event number of every entry."""
+    with phase("read"):
+        return ak.to_numpy(ak.flatten(_read_array(branch, executor=executor)))
+
+
+def _evtnum_order(evtnum):
+    """Return the permutation that sorts entries by event number."""
+    with phase("sort"):
+        return ak.argsort(evtnum)
+
+
+def _mix64(x):
+    """Apply the splitmix64 finalizer to an array of uint64, a bijection that
+    spreads every input bit over all output bits."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _value_bits(values):
+    """Return the bits of the values of a leaf as uint64, the same for values
+    that compare equal, and for all NaNs."""
+    if values.dtype.kind in "biu":
+        return values.astype(np.int64).view(np.uint64)
+    # adding zero turns -0.0 into 0.0
+    values = values.astype(np.float64) + 0.0
+    bits = values.view(np.uint64)
+    bits[np.isnan(values)] = np.uint64(0x7FF8000000000000)
+    return bits
+
+
+def _event_digest(values, counts, event_ids):
+    """Return a 64-bit digest of the values of a leaf in a chunk of events.
+
+    `values` are the flattened values of the events, `counts` the number of
+    values of each. Every event is hashed together with its id, e.g. its
+    event number, and the hashes are added up, so that digests of chunks
+    can be added up as well (modulo 2**64) and do not depend on the order
+    of the events.
+
+    >>> digest = _event_digest(np.array([1.0, 2.0, 3.0]), np.array([2, 1]), np.array([7, 8]))
+    >>> digest == _event_digest(np.array([3.0, 1.0, 2.0]), np.array([1, 2]), np.array([8, 7]))
+    True
+    >>> digest == _event_digest(np.array([2.0, 1.0, 3.0]), np.array([2, 1]), np.array([7, 8]))
+    False
+    >>> digest == _event_digest(np.array([1.0, 2.0, 3.0]), np.array([1, 2]), np.array([7, 8]))
+    False
+    """
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    position = (np.arange(len(values)) - np.repeat(offsets[:-1], counts)).astype(np.uint64)
+    value_hashes = _mix64(_value_bits(values) ^ _mix64(position))
+    sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(value_hashes, dtype=np.uint64)])
+    event_keys = _mix64(np.asarray(counts).astype(np.uint64) ^ _mix64(np.asarray(event_ids).astype(np.int64).view(np.uint64)))
+    event_hashes = _mix64(sums[offsets[1:]] - sums[offsets[:-1]] + event_keys)
+    return int(np.sum(event_hashes, dtype=np.uint64))
+
+
+class _LeafSummary:
+    """The values of a leaf in a file, summarized one chunk of events at a
+    time: their type, a quantile sketch, statistics for the trend database,
+    and a digest of the values of every event keyed by the event number,
+    see _event_digest(). Two files with the same digest hold the same values
+    for the same events, in whatever order.
+    """
+
+    def __init__(self, sketch_size):
+        self.type = None
+        self.depth = None
+        self.num_events = 0
+        self.digest = 0
+        self.sketch = QuantileSketch(k=sketch_size)
+        self.entries = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    @property
+    def nbytes(self):
+        return self.sketch.nbytes
+
+    @property
+    def supported(self):
+        return not (self.type is None or "string" in self.type or "bool" in self.type or self.depth < 2)
+
+    def update(self, values, event_ids):
+        if self.type is None:
+            self.type = str(ak.type(values))
+            self.depth = values.layout.minmax_depth[0]
+        if not self.supported:
+            return
+        while values.ndim > 2:
+            values = ak.flatten(values, axis=2)
+        counts = ak.to_numpy(ak.num(values, axis=1))
+        flat = ak.to_numpy(ak.flatten(values, axis=1))
+        self.num_events += len(counts)
+        self.digest = (self.digest + _event_digest(flat, counts, event_ids)) % 2**64
+        self.sketch.update(flat)
+        self.entries += len(flat)
+        finite = flat[np.isfinite(flat)].astype(np.float64)
+        if len(finite) > 0:
+            # combine the mean and the sum of squared deviations of the
+            # values seen so far with the ones of the chunk
+            count = self.count + len(finite)
+            mean = np.mean(finite)
+            delta = mean - self.mean
+            self.m2 += np.sum((finite - mean)**2) + delta**2 * self.count * len(finite) / count
+            self.mean += delta * len(finite) / count
+            self.count = count
+            self.min = float(np.min(finite)) if self.min is None else min(self.min, float(np.min(finite)))
+            self.max = float(np.max(finite)) if self.max is None else max(self.max, float(np.max(finite)))
+
+    def statistics(self):
+        """Return the statistics of the values, like
+        epic_capybara.trend.leaf_statistics()."""
+        if self.count == 0:
+            return {"entries": self.entries, "mean": None, "std": None, "min": None, "max": None}
+        return {
+            "entries": self.entries,
+            "mean": float(self.mean),
+            "std": float(np.sqrt(self.m2 / self.count)),
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+def _summarize_leaf(branch, event_ids, selected, entry_stop, sketch_size, executor=None, read_ahead=1):
+    """Summarize a leaf of a file, reading one RNTuple cluster or TTree
+    basket at a time, see _read_chunks().
+
+    `event_ids` holds the event number of every entry, `selected`, if not
+    None, whether every entry before `entry_stop` is compared.
+    """
+    summary = _LeafSummary(sketch_size)
+    for (start, stop), values in _read_chunks(branch, entry_stop, executor, read_ahead):
+        ids = event_ids[start:stop]
+        if selected is not None:
+            mask = selected[start:stop]
+            values = values[mask]
+            ids = ids[mask]
+        with phase("sketch"):
+            summary.update(values, ids)
+        if not summary.supported:
+            break
+    return summary
+
+
+def _leaf_digest(branch):
+    digest = hashlib.blake2b(digest_size=16)
+    with phase("digest"):
+        update_leaf_digest(digest, branch)
+    return digest.hexdigest()
+
+
+def _file_name(_file):
+    return getattr(_file, "name", _file)
+
+
+def _file_identity(_file):
+    """Identify the contents of an input file by its path, size and
+    modification time."""
+    path = os.path.realpath(_file_name(_file))
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime_ns)
+
+
+def _cached(cache, key, compute):
+    """Return the cached value for `key`, calling `compute` to create it if
+    it is missing. Without a cache, `compute` is called every time."""
+    if cache is None:
+        return compute()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.put(key, value)
+    return value
+
+
+def _evtnum_key(tree):
+    keys = tree.keys(recursive=True)
+    for evtnum_key in ["EventHeader/EventHeader.eventNumber", "EventHeader.eventNumber"]:
+        if evtnum_key in keys:
+            return evtnum_key
+    return None
+
+
+def _progressive_steps(max_events):
+    """
+    >>> list(takewhile(lambda n: n < 25000, _progressive_steps(200)))
+    [200, 2000, 20000]
+    """
+    while True:
+        yield max_events
+        max_events *= 10
+
+
+def _compare_distributions(key, file_arr, prev_file_arr):
+    """Return the KS and Anderson-Darling p-values for two differing arrays.
+
+    The AD p-value is None if the test could not be applied.
+    """
+    with phase("diff"):
+        flat_a = ak.to_numpy(ak.flatten(file_arr, axis=None))
+        flat_b = ak.to_numpy(ak.flatten(prev_file_arr, axis=None))
+    return _compare_values(key, flat_a, flat_b)
+
+
+def _compare_sketches(key, sketch_a, sketch_b):
+    """Return the KS and Anderson-Darling p-values for two differing leaves
+    from their quantile sketches.
+
+    Sketches that hold all values of their leaf are compared with the exact
+    tests of _compare_values(), others with approximate ones, see
+    epic_capybara.sketch.
+    """
+    if sketch_a.exact and sketch_b.exact:
+        return _compare_values(key, sketch_a.weighted_values()[0], sketch_b.weighted_values()[0])
+    if sketch_a.n == 0 or sketch_b.n == 0:
+        return 0, 0
+    with phase("ks"):
+        ks_pvalue = sketch_ks_pvalue(sketch_a, sketch_b)
+    with phase("ad"):
+        ad_pvalue = sketch_ad_pvalue(sketch_a, sketch_b)
+    return ks_pvalue, ad_pvalue
+
+
+def _compare_values(key, flat_a, flat_b):
+    """Return the KS and Anderson-Darling p-values for two arrays of values,
+    see _compare_distributions()."""
+    with phase("diff"):
+        if len(flat_a) == 0 or len(flat_b) == 0:
+            # We can only apply the tests on non-empty arrays
+            return 0, 0
+        # Fast path: identical flattened contents
+        if (flat_a.shape == flat_b.shape
+                and np.array_equal(flat_a, flat_b)):
+            return 1.0, 1.0
+
+    with phase("ks"):
+        ks_pvalue = kstest(flat_a, flat_b).pvalue
+
+    with phase("ad"):
+        # AD cost grows ~linearly with sample size and dominates the total
+        # runtime for high-multiplicity collections. Subsample above
+        # _AD_MAX_N per side: AD at N=1e4 already resolves p-values well
+        # below any threshold we colour on, so larger samples buy no useful
+        # sensitivity.
+        rng = _ad_rng(key)
+        ad_a, ad_b = flat_a, flat_b
+        if len(ad_a) > _AD_MAX_N:
+            ad_a = rng.choice(ad_a, _AD_MAX_N, replace=False)
+        if len(ad_b) > _AD_MAX_N:
+            ad_b = rng.choice(ad_b, _AD_MAX_N, replace=False)
+        try:
+            # anderson_ksamp fails if all samples are identical or if there
+            # are too few distinct values.
+            ad_result = anderson_ksamp(
+                [ad_a, ad_b],
+                # n_resamples sets p-value resolution; batch bounds peak
+                # memory (permutations are otherwise materialized all at
+                # once, which OOMs on large samples). Seed the permutation
+                # RNG from the same per-key stream used for subsampling so
+                # the reported p-value is reproducible.
+                method=PermutationMethod(n_resamples=999, batch=200, rng=rng),
+                variant="midrank",
+            )
+            ad_pvalue = float(ad_result.pvalue)
+        except (ValueError, TypeError):
+            ad_pvalue = None
+
+    return ks_pvalue, ad_pvalue
+
+
+def _read_leaf(key, files, trees, catalogs, sort_by_evtnum, entry_stops, prefetched, identities, cache, executor=None):
+    """Return a mapping from files to the values of a leaf, in the order of
+    event numbers.
+
+    Only entries before `entry_stops` (None for all) are read, and of those
+    the ones selected by `sort_by_evtnum`. `prefetched` maps (file index,
+    key) to values that were already read, those are consumed instead of
+    reading the leaf again. Sorted values are kept in `cache`, if given,
+    under the identity of their file. RNTuple clusters are read on
+    `executor`, see _read_array.
+    """
+    arrs = {}
+    for file_ix, (_file, tree, catalog) in enumerate(zip(files, trees, catalogs)):
+        if key not in catalog:
             continue
 
+        def read():
+            entry_stop = entry_stops[file_ix]
+            val = prefetched.pop((file_ix, key), None)
+            if val is None:
+                with phase("read"):
+                    val = _read_array(tree[catalog[key]], entry_stop=entry_stop, executor=executor)
+            elif entry_stop is not None:
+                val = val[:entry_stop]
+            if sort_by_evtnum[file_ix] is not None:
+                with phase("sort"):
+                    val = val[sort_by_evtnum[file_ix]]
+            return val
+
+        arrs[_file] = _cached(cache, ("leaf", identities[file_ix], key, entry_stops[file_ix]), read)
+    return arrs
+
+
+def _skip_leaf(key, types, depths):
+    """Return whether a leaf of the given types and depths in the files can
+    not be histogrammed, telling why."""
+    if any("string" in leaf_type for leaf_type in types):
+        click.echo(f"String value detected for key \"{key}\". Skipping...")
+        return True
+    if any("bool" in leaf_type for leaf_type in types):
+        click.echo(f"Bool value detected for key \"{key}\". Skipping...")
+        return True
+    if any(depth < 2 for depth in depths):
+        # Not possible for PODIO, here for general ROOT file support
+        print(f"Skipping non-array branch \"{key}\"")
+        return True
+    return False
+
+
+def _binning(types, x_range):
+    """Return the histogram range and number of bins of a leaf of the given
+    types whose values span `x_range`."""
+    nbins = 10
+
+    if (any("* uint" in leaf_type for leaf_type in types)
+       or any("* int" in leaf_type for leaf_type in types)):
+        x_range = x_range + 1
+        nbins = int(min(100, np.ceil(x_range)))
+    else:
+        x_range = x_range * 1.1
+
+    if x_range == 0:
+        x_range = 1
+    return x_range, nbins
+
+
+def _compare_leaf(key, arrs, files, labels):
+    """Histogram a leaf from every file and compare consecutive files.
+
+    `arrs` maps files to the leaf values. Returns None if the leaf can not
+    be histogrammed. Otherwise returns a dict with the plain plot data
+    ("plot"), the minimal p-values over the compared pairs of files
+    ("pvalue", "ks_pvalue", "ad_pvalue", None if no differences were found)
+    and whether the leaf is identical in all files ("matching").
+    """
+    types = [str(ak.type(a)) for a in arrs.values()]
+    if _skip_leaf(key, types, [a.layout.minmax_depth[0] for a in arrs.values()]):
+        return None
+
+    with phase("histogram"):
         x_min = min(filter(
             lambda v: v is not None,
-            map(lambda a: ak.min(ak.mask(a, np.isfinite(a))), arr[key].values())
+            map(lambda a: ak.min(ak.mask(a, np.isfinite(a))), arrs.values())
         ), default=None)
         if x_min is None:
-            continue
+            return None
         x_range = max(filter(
             lambda v: v is not None,
-            map(lambda a: ak.max(ak.mask(a - x_min, np.isfinite(a))), arr[key].values())
+            map(lambda a: ak.max(ak.mask(a - x_min, np.isfinite(a))), arrs.values())
         ), default=None)
-        nbins = 10
+    x_range, nbins = _binning(types, x_range)
 
-        if (any("* uint" in str(ak.type(a)) for a in arr[key].values())
-           or any("* int" in str(ak.type(a)) for a in arr[key].values())):
-            x_range = x_range + 1
-            nbins = int(min(100, np.ceil(x_range)))
-        else:
-            x_range = x_range * 1.1
+    def differs(file_arr, prev_file_arr):
+        return ((ak.num(file_arr, axis=0) != ak.num(prev_file_arr, axis=0))
+                or ak.any(ak.num(file_arr, axis=1)
+                          != ak.num(prev_file_arr, axis=1))
+                or ak.any(ak.nan_to_none(file_arr)
+                          != ak.nan_to_none(prev_file_arr)))
 
-        if x_range == 0:
-            x_range = 1
+    def compare(file_arr, prev_file_arr):
+        ks_pvalue, ad_pvalue = _compare_distributions(key, file_arr, prev_file_arr)
+        return ks_pvalue, ad_pvalue, [prev_file_arr, file_arr]
 
-        if "." in key:
-            branch_name = key.split(".", 1)[0]
-            leaf_name = key
-        else:
-            branch_name = key
-            leaf_name = key
+    def fill(h, file_arr):
+        h.fill(x=ak.flatten(file_arr - x_min, axis=None))
 
-        midpoint_expr = collection_step_exprs.setdefault(
-            branch_name,
-            CustomJSExpr(code=_MIDPOINT_EXPR_CODE),
-        )
-        fig = figure(x_axis_label=leaf_name, y_axis_label="Entries")
-        if x_range < 1.:
-            fig.xaxis.formatter = PrintfTickFormatter(format="%.2g")
-        collection_figs.setdefault(branch_name, []).append(fig)
-        y_max = 0
-
-        prev_file_arr = None
-        vis_params = [
-          ("green", 1.5, "solid", " "),
-          ("red", 3, "dashed", ","),
-          ("blue", 2, "dotted", "."),
-        ]
-
-        leaf_min_pvalue = 1.0
-        if set(arr[key].keys()) != set(files):
-            # not every file has the key
-            collection_with_diffs[branch_name] = 0.0
-            leaf_min_pvalue = 0.0
-
-        for _file, label, (color, line_width, line_dash, hatch_pattern) in zip(files, labels, vis_params):
-            if _file not in arr[key]:
-                continue
-            file_arr = arr[key][_file]
-
-            # diff, KS and Anderson-Darling k-sample tests
-            pvalue = None
-            ks_pvalue = None
-            ad_pvalue = None
-            if prev_file_arr is not None:
-                if ((ak.num(file_arr, axis=0) != ak.num(prev_file_arr, axis=0))
-                   or ak.any(ak.num(file_arr, axis=1)
-                             != ak.num(prev_file_arr, axis=1))
-                   or ak.any(ak.nan_to_none(file_arr)
-                             != ak.nan_to_none(prev_file_arr))):
-                    if (ak.num(ak.flatten(file_arr, axis=None), axis=0) > 0 and
-                        ak.num(ak.flatten(prev_file_arr, axis=None), axis=0) > 0):
-                        # We can only apply the tests on non-empty arrays
-                        flat_a = ak.to_numpy(ak.flatten(file_arr, axis=None))
-                        flat_b = ak.to_numpy(ak.flatten(prev_file_arr, axis=None))
-                        # Fast path: identical flattened contents
-                        if (flat_a.shape == flat_b.shape
-                                and np.array_equal(flat_a, flat_b)):
-                            ks_pvalue = 1.0
-                            ad_pvalue = 1.0
-                        else:
-                            ks_pvalue = kstest(flat_a, flat_b).pvalue
-                            # AD cost grows ~linearly with sample size and
-                            # dominates the total runtime for high-multiplicity
-                            # collections. Subsample above _AD_MAX_N per side:
-                            # AD at N=1e4 already resolves p-values well below
-                            # any threshold we colour on, so larger samples buy
-                            # no useful sensitivity.
-                            rng = _ad_rng(key)
-                            ad_a, ad_b = flat_a, flat_b
-                            if len(ad_a) > _AD_MAX_N:
-                                ad_a = rng.choice(ad_a, _AD_MAX_N, replace=False)
-                            if len(ad_b) > _AD_MAX_N:
-                                ad_b = rng.choice(ad_b, _AD_MAX_N, replace=False)
-                            try:
-                                # anderson_ksamp fails if all samples are
-                                # identical or if there are too few distinct
-                                # values.
-                                ad_result = anderson_ksamp(
-                                    [ad_a, ad_b],
-                                    # n_resamples sets p-value resolution;
-                                    # batch bounds peak memory (permutations
-                                    # are otherwise materialized all at once,
-                                    # which OOMs on large samples).
-                                    # Seed the permutation RNG from the same
-                                    # per-key stream used for subsampling so
-                                    # the reported p-value is reproducible.
-                                    method=PermutationMethod(n_resamples=999, batch=200, rng=rng),
-                                    variant="midrank",
-                                )
-                                ad_pvalue = float(ad_result.pvalue)
-                            except (ValueError, TypeError):
-                                ad_pvalue = None
-                        if ad_pvalue is None:
-                            pvalue = ks_pvalue
-                        else:
-                            pvalue = min(ks_pvalue, ad_pvalue)
-                    else:
-                        ks_pvalue = 0
-                        ad_pvalue = 0
-                        pvalue = 0
-                    print(key)
-                    print(f"p_KS = {ks_pvalue:.3f}",
-                          f"p_AD = {ad_pvalue:.3f}" if ad_pvalue is not None else "p_AD = n/a")
-                    print(prev_file_arr)
-                    print(file_arr)
-                    collection_with_diffs[branch_name] = min(pvalue, collection_with_diffs.get(branch_name, 1.))
-                    collection_ks_pvalue[branch_name] = min(ks_pvalue, collection_ks_pvalue.get(branch_name, 1.))
-                    if ad_pvalue is not None:
-                        collection_ad_pvalue[branch_name] = min(ad_pvalue, collection_ad_pvalue.get(branch_name, 1.))
-                    leaf_min_pvalue = min(leaf_min_pvalue, pvalue)
-
-            # Figure
+    return _histogram_leaf(key, arrs, files, labels, x_min, x_range, nbins, differs, compare, fill)
+
+
+def _compare_summaries(key, summaries, files, labels):
+    """Like _compare_leaf(), from the _LeafSummary of the leaf in every file.
+
+    Files hold the same values when their digests match. The tests are
+    approximated from the sketches of leaves with more values than fit in a
+    sketch level, see _compare_sketches(), and so are the histograms: the
+    count of every bin is then off by at most twice the error of the
+    sketch, QuantileSketch.max_error.
+    """
+    read = [summary for summary in summaries.values() if summary.type is not None]
+    types = [summary.type for summary in read]
+    if _skip_leaf(key, types, [summary.depth for summary in read]):
+        return None
+
+    x_min = min((summary.min for summary in read if summary.min is not None), default=None)
+    if x_min is None:
+        return None
+    x_range = max(summary.max - x_min for summary in read if summary.max is not None)
+    x_range, nbins = _binning(types, x_range)
+
+    def differs(summary, prev_summary):
+        return summary.num_events != prev_summary.num_events or summary.digest != prev_summary.digest
+
+    def compare(summary, prev_summary):
+        ks_pvalue, ad_pvalue = _compare_sketches(key, summary.sketch, prev_summary.sketch)
+        return ks_pvalue, ad_pvalue, []
+
+    def fill(h, summary):
+        values, weights = summary.sketch.weighted_values()
+        h.fill(x=values - x_min, weight=weights)
+
+    return _histogram_leaf(key, summaries, files, labels, x_min, x_range, nbins, differs, compare, fill)
+
+
+def _histogram_leaf(key, leaves, files, labels, x_min, x_range, nbins, differs, compare, fill):
+    """Histogram and compare the leaf values or summaries in `leaves`, see
+    _compare_leaf(). `differs` and `compare` take the ones of a file and the
+    previous file, `compare` returns the KS and AD p-values and what to
+    print, `fill` fills a histogram with the ones of a file."""
+    y_max = 0
+
+    prev_leaf = None
+    # Bokeh models are only created when rendering, here we collect
+    # plain histogram data
+    plot = {
+        "key": key,
+        "x_range": x_range,
+        "series": [],
+    }
+    result = {
+        "plot": plot,
+        "pvalue": None,
+        "ks_pvalue": None,
+        "ad_pvalue": None,
+    }
+
+    leaf_min_pvalue = 1.0
+    if set(leaves.keys()) != set(files):
+        # not every file has the key
+        result["pvalue"] = 0.0
+        leaf_min_pvalue = 0.0
+
+    # only three line styles are available
+    for file_ix, (_file, label) in enumerate(zip(files[:3], labels)):
+        if _file not in leaves:
+            continue
+        leaf = leaves[_file]
+
+        # diff, KS and Anderson-Darling k-sample tests
+        pvalue = None
+        ks_pvalue = None
+        ad_pvalue = None
+        if prev_leaf is not None:
+            with phase("diff"):
+                leaf_differs = differs(leaf, prev_leaf)
+            if leaf_differs:
+                ks_pvalue, ad_pvalue, details = compare(leaf, prev_leaf)
+                if ad_pvalue is None:
+                    pvalue = ks_pvalue
+                else:
+                    pvalue = min(ks_pvalue, ad_pvalue)
+                print(key)
+                print(f"p_KS = {ks_pvalue:.3f}",
+                      f"p_AD = {ad_pvalue:.3f}" if ad_pvalue is not None else "p_AD = n/a")
+                for detail in details:
+                    print(detail)
+                result["pvalue"] = _min_pvalue(result["pvalue"], pvalue)
+                result["ks_pvalue"] = _min_pvalue(result["ks_pvalue"], ks_pvalue)
+                result["ad_pvalue"] = _min_pvalue(result["ad_pvalue"], ad_pvalue)
+                leaf_min_pvalue = min(leaf_min_pvalue, pvalue)
+
+        # Histogram
+        with phase("histogram"):
             h = (
                 Hist.new
                 .Reg(nbins, 0, x_range, name="x", label=key)
                 .Int64()
             )
-            h.fill(x=ak.flatten(file_arr - x_min, axis=None))
+            fill(h, leaf)
 
             ys, edges = h.to_numpy()
-            y0 = np.concatenate([ys, [ys[-1]]])
-            legend_parts = [label]
-            if ks_pvalue is not None:
-                legend_parts.append(f"{100*ks_pvalue:.0f}%CL KS")
-            if ad_pvalue is not None:
-                legend_parts.append(f"{100*ad_pvalue:.0f}%CL AD")
-            legend_label = "\n".join(legend_parts)
-            source = ColumnDataSource(
-                {
-                    "x": edges + x_min,
-                    "y1": y0 - np.sqrt(y0),
-                    "y2": y0 + np.sqrt(y0),
-                }
-            )
-            step_r = fig.step(
-                x="x",
-                y={"expr": midpoint_expr},
-                mode="after",
-                source=source,
-                legend_label=legend_label,
-                line_color=color,
-                line_width=line_width,
-                line_dash=line_dash,
-            )
-            step_r.nonselection_glyph = step_r.glyph
-            varea_r = fig.varea_step(
-                x="x",
-                y1="y1",
-                y2="y2",
-                step_mode="after",
-                source=source,
-                legend_label=legend_label,
-                fill_color=color if hatch_pattern == " " else None,
-                fill_alpha=0.25,
-                hatch_color=color,
-                hatch_alpha=0.5,
-                hatch_pattern=hatch_pattern,
-            )
-            varea_r.nonselection_glyph = varea_r.glyph
-            fig.legend.background_fill_alpha = 0.5 # make legend more transparent
+        y0 = np.concatenate([ys, [ys[-1]]])
+        legend_parts = [label]
+        if ks_pvalue is not None:
+            legend_parts.append(f"{100*ks_pvalue:.0f}%CL KS")
+        if ad_pvalue is not None:
+            legend_parts.append(f"{100*ad_pvalue:.0f}%CL AD")
+        legend_label = "\n".join(legend_parts)
+        plot["x"] = edges + x_min
+        plot["series"].append((file_ix, y0, legend_label))
 
-            y_max = max(y_max, np.max(y0 + np.sqrt(y0)))
-            prev_file_arr = file_arr
+        y_max = max(y_max, np.max(y0 + np.sqrt(y0)))
+        prev_leaf = leaf
 
-        if leaf_min_pvalue == 1.0:
-            collection_matching_count[branch_name] = collection_matching_count.get(branch_name, 0) + 1
+    result["matching"] = leaf_min_pvalue == 1.0
 
-        x_bounds = (x_min - 0.05 * x_range, x_min + 1.05 * x_range)
-        y_bounds = (- 0.05 * y_max, 1.05 * y_max)
-        # Set y range for histograms
-        if np.all(np.isfinite(x_bounds)):
-            try:
-                fig.x_range = Range1d(
-                    *x_bounds,
-                    bounds=x_bounds)
-            except ValueError as e:
-                click.secho(str(e), fg="red", err=True)
-        else:
-            click.secho(f"overflow while calculating x bounds for \"{key}\"", fg="red", err=True)
-        if np.all(np.isfinite(y_bounds)):
-            try:
-                fig.y_range = Range1d(
-                    *y_bounds,
-                    bounds=y_bounds)
-            except ValueError as e:
-                click.secho(str(e), fg="red", err=True)
-        else:
-            click.secho(f"overflow while calculating y bounds for \"{key}\"", fg="red", err=True)
-
-    def to_filename(branch_name):
-        return branch_name.replace("#", "__pound__").replace("/", "__underscore__")
-
-    def option_key(item):
-        collection_name, figs = item
-        key = ""
-        if collection_name in collection_with_diffs:
-            if collection_with_diffs[collection_name] > 0.99:
-                key += " 0.99"
-            elif collection_with_diffs[collection_name] > 0.95:
-                key += " 0.95"
-            elif collection_with_diffs[collection_name] > 0.67:
-                key += " 0.67"
-            else:
-                key += " 0.00"
-        key += collection_name.lstrip("_")
-        return key
-
-    options = [("", "")]
-    for collection_name, figs in sorted(collection_figs.items(), key=option_key):
-        marker = ""
-        if collection_name in collection_with_diffs:
-            if collection_with_diffs[collection_name] > 0.99:
-                marker = " (*)"
-            elif collection_with_diffs[collection_name] > 0.95:
-                marker = " (**)"
-            elif collection_with_diffs[collection_name] > 0.67:
-                marker = " (***)"
+    plot["x_bounds"] = (x_min - 0.05 * x_range, x_min + 1.05 * x_range)
+    plot["y_bounds"] = (- 0.05 * y_max, 1.05 * y_max)
+
+    return result
+
+
+def _read_leaf_summaries(key, files, trees, catalogs, event_ids, selections, entry_stops, identities, cache, sketch_size, executor=None, read_ahead=1):
+    """Return a mapping from files to the _LeafSummary of a leaf, see
+    _summarize_leaf(). Summaries are kept in `cache`, if given, like the
+    values of _read_leaf()."""
+    summaries = {}
+    for file_ix, (_file, tree, catalog) in enumerate(zip(files, trees, catalogs)):
+        if key not in catalog:
+            continue
+        summaries[_file] = _cached(
+            cache, ("summary", identities[file_ix], key, entry_stops[file_ix], sketch_size),
+            lambda: _summarize_leaf(
+                tree[catalog[key]], event_ids[file_ix], selections[file_ix], entry_stops[file_ix],
+                sketch_size, executor, read_ahead,
+            ),
+        )
+    return summaries
+
+
+def _record_trend(trend, key, statistics, result, file_ix):
+    plot = result["plot"]
+    # the histogram is only available for the files that are plotted
+    counts = next((y0[:-1] for ix, y0, _ in plot["series"] if ix == file_ix), None)
+    trend.add(key, statistics, result, None if counts is None else plot["x"], counts)
+
+
+def _make_report(files, match, unmatch, output_dir, pack, compression, compression_level, jobs, incremental, cache=None, max_events=None, trend=None, read_threads=None, sketch_size=None, mp_context=None):
+    """Compare the "events" trees of `files` and write a report to `output_dir`.
+
+    `files` are paths or file objects. If a `cache` is given, catalogs and
+    decoded leaves of the files are looked up in it and stored to it, see
+    epic_capybara.daemon.LRUCache. With `max_events`, only the events with
+    the lowest event numbers are compared, the same ones in every file.
+    If a `trend` recorder is given (see epic_capybara.trend), the statistics,
+    histogram and p-values of every compared leaf of the last file are
+    recorded to it. RNTuple clusters are read by `read_threads` threads
+    (defaults to one, reading whole fields). With `sketch_size`, leaves are
+    read one RNTuple cluster or TTree basket at a time and only summarized,
+    see _LeafSummary, so that the memory per leaf does not grow with the
+    number of its values; those with more values than `sketch_size` are
+    compared and histogrammed approximately, from quantile sketches.
+    `mp_context` selects how rendering processes are started, see
+    epic_capybara.render.render_collections.
+    """
+    # closes the input files and stops the read threads, also on errors
+    with ExitStack() as cleanup:
+        identities = [_file_identity(_file) if cache is not None else None for _file in files]
+        with phase("open"):
+            trees = []
+            for _file in files:
+                root_file = uproot.open(_file)
+                # file objects belong to the caller
+                if isinstance(_file, (str, os.PathLike)):
+                    cleanup.callback(root_file.close)
+                trees.append(root_file["events"])
+            catalogs = []
+            for tree, identity in zip(trees, identities):
+                catalog = _cached(cache, ("catalog", identity), lambda: _catalog(tree))
+                catalogs.append({
+                    key: tree_key for key, tree_key in catalog.items()
+                    if match_filter(key, match, unmatch)
+                })
+        register_counter("bytes_read", lambda: sum(tree.file.source.num_requested_bytes for tree in trees))
+        if read_threads is None:
+            read_threads = 1
+        # a single thread is slower than reading whole fields
+        executor = ThreadPoolExecutor(max_workers=read_threads) if read_threads > 1 else None
+        if executor is not None:
+            cleanup.callback(executor.shutdown)
+
+        sort_by_evtnum = []
+        entry_stops = []
+        # only for sketch_size, see _summarize_leaf
+        event_ids = []
+        selections = []
+        evtnum_digests = []
+        for tree, identity in zip(trees, identities):
+            evtnum_key = _evtnum_key(tree)
+            if evtnum_key is not None:
+                evtnum = _cached(cache, ("evtnum", identity), lambda: _read_evtnum(tree[evtnum_key], executor))
+                order = _cached(cache, ("evtnum_order", identity), lambda: _evtnum_order(evtnum))
+                entry_stop = None
+                selected = None
+                if max_events is not None:
+                    order = order[:max_events]
+                    # read up to the last selected entry, which is close to
+                    # max_events for files written in event number order
+                    entry_stop = int(ak.max(order)) + 1 if len(order) > 0 else 0
+                    selected = np.zeros(entry_stop, dtype=bool)
+                    selected[ak.to_numpy(order)] = True
+                sort_by_evtnum.append(order)
+                entry_stops.append(entry_stop)
+                event_ids.append(evtnum)
+                selections.append(selected)
             else:
-                marker = " (****)"
-        options.append((to_filename(collection_name), collection_name + marker))
-
-    from bokeh.models import CustomJS, Select, DataTable, TableColumn, HTMLTemplateFormatter, NumberFormatter, StringFormatter
-    from bokeh.models.comparisons import CustomJSCompare
-
-    # BokehJS creates the comparator as new Function("x", "y", ..., code),
-    # so the cell values are available as `x` and `y` in the snippet.
-    _ks_sorter = CustomJSCompare(code="""
-        if (x === '' && y === '') return 0;
-        if (x === '') return 1;
-        if (y === '') return -1;
-        const nx = parseFloat(x), ny = parseFloat(y);
-        return nx < ny ? -1 : nx > ny ? 1 : 0;
-    """)
-
-    _ad_sorter = CustomJSCompare(code="""
-        if (x === '' && y === '') return 0;
-        if (x === '') return 1;
-        if (y === '') return -1;
-        if (x === 'n/a' && y === 'n/a') return 0;
-        if (x === 'n/a') return 1;
-        if (y === 'n/a') return -1;
-        const nx = parseFloat(x), ny = parseFloat(y);
-        return nx < ny ? -1 : nx > ny ? 1 : 0;
-    """)
-
-    def mk_summary_table():
-        rows = []
-        for collection_name, figs in sorted(
-            collection_figs.items(),
-            key=lambda item: item[0].lstrip("_"),
-        ):
-            if collection_name in collection_with_diffs:
-                pvalue = collection_with_diffs[collection_name]
-                if pvalue > 0.99:
-                    color = "#28a745"  # green
-                elif pvalue > 0.95:
-                    color = "#ffc107"  # yellow
-                elif pvalue > 0.67:
-                    color = "#fd7e14"  # orange
-                else:
-                    color = "#dc3545"  # red
-                ks_str = (f"{collection_ks_pvalue[collection_name]:.3f}"
-                          if collection_name in collection_ks_pvalue else "")
-                ad_str = (f"{collection_ad_pvalue[collection_name]:.3f}"
-                          if collection_name in collection_ad_pvalue else "n/a")
+                sort_by_evtnum.append(None)
+                entry_stops.append(max_events)
+                # without event numbers, entries are compared in order
+                event_ids.append(np.arange(tree.num_entries))
+                selections.append(None)
+            if incremental and evtnum_key is not None:
+                evtnum_digests.append(_cached(cache, ("evtnum_digest", identity), lambda: _leaf_digest(tree[evtnum_key])))
             else:
-                color = "transparent"
-                ks_str = ""
-                ad_str = ""
-            n_total = len(figs)
-            n_match = collection_matching_count.get(collection_name, 0)
-            n_diff = n_total - n_match
-            rows.append((collection_name, color, ks_str, ad_str, n_match, n_diff, n_total))
-
-        source = ColumnDataSource({
-            "collection": [r[0] for r in rows],
-            "filename":   [to_filename(r[0]) for r in rows],
-            "color":      [r[1] for r in rows],
-            "ks_pvalue":  [r[2] for r in rows],
-            "ad_pvalue":  [r[3] for r in rows],
-            "nmatch":     [r[4] for r in rows],
-            "ndiff":      [r[5] for r in rows],
-            "nplots":     [r[6] for r in rows],
-        })
-        square_style = (
-            'display:inline-block;width:0.9em;height:0.9em;'
-            'margin-right:6px;vertical-align:middle;'
-            'border:1px solid #999;background-color:<%= color %>;'
-        )
-        link_fmt = HTMLTemplateFormatter(
-            template=f'<span style="{square_style}"></span>'
-                     '<a href="#<%= filename %>"><%= value %></a>'
-        )
-        right_str = StringFormatter(text_align="right")
-        right_num = NumberFormatter(text_align="right")
-        columns = [
-            TableColumn(field="collection", title="Collection", formatter=link_fmt, width=500),
-            TableColumn(field="ks_pvalue", title="min KS p-value", formatter=right_str, width=120, sorter=_ks_sorter),
-            TableColumn(field="ad_pvalue", title="min AD p-value", formatter=right_str, width=120, sorter=_ad_sorter),
-            TableColumn(field="nmatch", title="# matching", formatter=right_num, width=80),
-            TableColumn(field="ndiff", title="# differing", formatter=right_num, width=80),
-            TableColumn(field="nplots", title="# plots", formatter=right_num, width=80),
-        ]
-        table = DataTable(
-            source=source,
-            columns=columns,
-            width=800,
-            sizing_mode="stretch_height",
-            index_position=None,
-            sortable=True,
-            selectable=True,
-        )
-        source.selected.js_on_change("indices", CustomJS(args={"source": source}, code="""
-          const idx = cb_obj.indices;
-          if (idx.length > 0) {
-            const filename = source.data["filename"][idx[0]];
-            window.location.hash = "#" + filename;
-            fetchAndReplaceBokehDocument(filename);
-          }
-        """))
-        return table
-
-    def mk_dropdown(value=""):
-        dropdown = Select(title="Select branch (**** < 67% CL, ..., * > 99% CL stat. equiv.):", value=value, options=options)
-        dropdown.js_on_change("value", CustomJS(code="""
-          console.log('dropdown: ' + this.value, this.toString())
-          if (this.value != "") {
-            window.location.hash = "#" + this.value;
-            fetchAndReplaceBokehDocument(this.value);
-          } else {
-            // Empty option selected: navigate back to the index page.
-            window.location.hash = "";
-          }
-        """))
-        return dropdown
-
-    def mk_dropdown_minimal(value=""):
-        # Embed only the currently selected option; the full list is stored once
-        # in index.html's JavaScript and restored client-side after each load.
-        # This avoids repeating a ~54 KB options list in every .json.gz file.
-        label = next((lbl for val, lbl in options if val == value), value)
-        minimal_options = [("", "")] + ([(value, label)] if value else [])
-        dropdown = Select(title="Select branch (**** < 67% CL, ..., * > 99% CL stat. equiv.):", value=value, options=minimal_options)
-        dropdown.js_on_change("value", CustomJS(code="""
-          console.log('dropdown: ' + this.value, this.toString())
-          if (this.value != "") {
-            window.location.hash = "#" + this.value;
-            fetchAndReplaceBokehDocument(this.value);
-          } else {
-            // Empty option selected: navigate back to the index page.
-            window.location.hash = "";
-          }
-        """))
-        return dropdown
-
-    from bokeh.layouts import column
-    from bokeh.embed import json_item
-    import json
-
-    os.makedirs("capybara-reports", exist_ok=True)
-
-    for collection_name, figs in collection_figs.items():
-        item = column(
-          mk_dropdown_minimal(collection_name),
-          gridplot(figs, ncols=3, width=400, height=300),
-        )
+                evtnum_digests.append(hashlib.blake2b(digest_size=16).hexdigest())
 
-        with gzip.open(f"capybara-reports/{to_filename(collection_name)}.json.gz", "wt") as fp:
-            json.dump(json_item(item), fp, separators=(',', ':'))
-
-    curdoc().js_on_event(DocumentReady, CustomJS(args={"all_options": options}, code="""
-      window._bokehSelectOptions = all_options;
-
-      function fetchAndReplaceBokehDocument(location) {
-        fetch(location + '.json.gz')
-          .then(async function(response) {
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-
-            const ds = new DecompressionStream('gzip');
-            const decompressedStream = response.body.pipeThrough(ds);
-            const decompressedResponse = new Response(decompressedStream);
-            const item = await decompressedResponse.json();
-
-            Bokeh.documents[0].replace_with_json(item.doc);
-
-            // Restore the full options list to the newly loaded Select widget.
-            for (const [, model] of Bokeh.documents[0]._all_models) {
-              if (model.options instanceof Array) {
-                model.options = window._bokehSelectOptions;
-                model.value = location;
-                break;
-              }
-            }
-          })
-          .catch(function(error) {
-            console.error('Fetch or decompression failed:', error);
-          });
-      }
-
-      window.onhashchange = function() {
-        var location = window.location.hash.replace(/^#/, "");
-        if (location == "") {
-          // No hash: return to the index page. Since there is no index.json.gz,
-          // just reload the page to get a fresh index.html.
-          if (typeof window.current_location !== 'undefined') {
-            window.location.reload();
-          }
-          return;
-        }
-        if ((typeof current_location === 'undefined') || (current_location != location)) {
-          fetchAndReplaceBokehDocument(location);
-          window.current_location = location;
+        paths = skip_common_prefix([_file_name(_file).split("/") for _file in files])
+        paths = skip_common_prefix([reversed(list(path)) for path in paths])
+        labels = ["/".join(reversed(list(reversed_path))) for reversed_path in paths]
+
+        collection_keys = {}
+        for catalog in catalogs:
+            for key in catalog:
+                collection_keys.setdefault(_collection_name(key), set()).add(key)
+
+        os.makedirs(output_dir, exist_ok=True)
+        settings = {
+            "code": code_version(),
+            "labels": labels,
+            "pack": pack,
+            "compression": compression,
+            "compression_level": compression_level,
+            "max_events": max_events,
+            "sketch_size": sketch_size,
         }
-      }
-      window.onhashchange();
-    """))
-    output_file(filename="capybara-reports/index.html", title="ePIC capybara report")
-    save(column(
-        mk_dropdown(),
-        mk_summary_table(),
-        sizing_mode="stretch_height",
-    ))
+        if incremental:
+            previous = load_manifest(output_dir, settings)
+        else:
+            previous = {}
+            remove_manifest(output_dir)
+        manifest = {}
+
+        summary = {}
+        collection_plots = {}
+        writer = (PackWriter if pack else DirectoryWriter)(output_dir)
+        try:
+            for collection_name in sorted(collection_keys):
+                with phase(collection_name, category="collection"):
+                    keys = sorted(collection_keys[collection_name])
+                    filename = f"{to_filename(collection_name)}{DOCUMENT_SUFFIXES[compression]}"
+
+                    # values that were decoded while computing the digest
+                    prefetched = {}
+                    if incremental:
+                        digest = hashlib.blake2b(digest_size=16)
+                        for file_ix, (tree, catalog) in enumerate(zip(trees, catalogs)):
+                            digest.update(f"\0{file_ix}:{evtnum_digests[file_ix]}".encode())
+                            for key in keys:
+                                if key in catalog:
+                                    digest.update(f"\0{key}\0".encode())
+                                    with phase("digest"):
+                                        array = update_leaf_digest(digest, tree[catalog[key]])
+                                    if array is not None and sketch_size is None:
+                                        prefetched[(file_ix, key)] = array
+                        digest = digest.hexdigest()
+
+                        entry = previous.get(collection_name)
+                        if (entry is not None and entry["digest"] == digest
+                                and (entry["summary"] is None or writer.can_keep(entry["filename"]))):
+                            click.secho(f"Collection \"{collection_name}\" is unchanged", fg="green", err=True)
+                            manifest[collection_name] = entry
+                            if entry["summary"] is not None:
+                                summary[collection_name] = entry["summary"]
+                            continue
+
+                    results = []
+                    for key in keys:
+                        with phase(key, category="leaf"):
+                            if sketch_size is None:
+                                leaves = _read_leaf(key, files, trees, catalogs, sort_by_evtnum, entry_stops, prefetched, identities, cache, executor)
+                                result = _compare_leaf(key, leaves, files, labels)
+                            else:
+                                leaves = _read_leaf_summaries(
+                                    key, files, trees, catalogs, event_ids, selections, entry_stops, identities, cache,
+                                    sketch_size, executor, read_threads,
+                                )
+                                result = _compare_summaries(key, leaves, files, labels)
+                            if result is not None:
+                                results.append(result)
+                                if trend is not None and files[-1] in leaves:
+                                    leaf = leaves[files[-1]]
+                                    statistics = leaf_statistics(leaf) if sketch_size is None else leaf.statistics()
+                                    _record_trend(trend, key, statistics, result, len(files) - 1)
+
+                    if results:
+                        summary[collection_name] = {
+                            "n_plots": len(results),
+                            "n_match": int(sum(result["matching"] for result in results)),
+                            "pvalue": reduce(_min_pvalue, (result["pvalue"] for result in results)),
+                            "ks_pvalue": reduce(_min_pvalue, (result["ks_pvalue"] for result in results)),
+                            "ad_pvalue": reduce(_min_pvalue, (result["ad_pvalue"] for result in results)),
+                        }
+                        collection_plots[collection_name] = [result["plot"] for result in results]
+                    if incremental:
+                        manifest[collection_name] = {
+                            "digest": digest,
+                            "filename": filename if results else None,
+                            "summary": summary.get(collection_name),
+                        }
+
+            if executor is not None:
+                # reading is done, stop the threads before render_collections() forks
+                executor.shutdown()
+
+            rendered = render_collections(
+                [
+                    (
+                        collection_name,
+                        option_label(collection_name, summary[collection_name]["pvalue"]),
+                        plots,
+                        compression,
+                        compression_level,
+                    )
+                    for collection_name, plots in sorted(collection_plots.items())
+                ],
+                jobs=jobs,
+                mp_context=mp_context,
+            )
+            # stops the rendering processes if writing fails
+            cleanup.callback(rendered.close)
+            for collection_name in sorted(summary):
+                if collection_name in collection_plots:
+                    with phase(collection_name, category="collection"):
+                        with phase("render"):
+                            filename, data = next(rendered)
+                        with phase("write"):
+                            writer.write(filename, data)
+                else:
+                    with phase("write"):
+                        writer.keep(manifest[collection_name]["filename"])
+        except BaseException:
+            writer.abort()
+            raise
+        with phase("write"):
+            writer.close()
+
+        if incremental:
+            if not pack:
+                # remove documents of collections that are gone or no
+                # longer have plots
+                for collection_name, entry in previous.items():
+                    if (entry["filename"] is not None
+                            and manifest.get(collection_name, {}).get("filename") != entry["filename"]):
+                        try:
+                            os.remove(os.path.join(output_dir, entry["filename"]))
+                        except FileNotFoundError:
+                            pass
+            save_manifest(output_dir, settings, manifest)
+
+        if trend is not None:
+            with phase("trend"):
+                trend.flush()
+
+        notes = []
+        if max_events is not None:
+            notes.append(f"Preview comparing at most {max_events} events per file.")
+        if sketch_size is not None:
+            notes.append(
+                f"Histograms and KS and AD p-values of leaves with more than {sketch_size} values are approximated from quantile sketches:"
+                " KS p-values are conservative, AD ones may be smaller than the exact ones."
+            )
+        with phase("index"):
+            write_index(
+                output_dir, summary, pack=pack, compression=compression,
+                note=" ".join(notes) or None,
+            )
+
+        return summary
+
+
+@click.command()
+@click.argument("files", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+@click.option(
+    "-m", "--match", multiple=True,
+    help="Only include collections with names matching a regex"
+)
+@click.option(
+    "-M", "--unmatch", multiple=True,
+    help="Exclude collections with names matching a regex"
+)
+@click.option(
+    "--serve", is_flag=True,
+    default=False,
+    help="Run a local HTTP server to view the report"
+)
+@click.option(
+    "--pack", is_flag=True,
+    default=False,
+    help="Store all collections in a single pack file with an index, instead of one file per collection"
+)
+@click.option(
+    "--compression", type=click.Choice(sorted(DOCUMENT_SUFFIXES)),
+    default="gzip",
+    help="Compression of the per-collection documents (zstd requires the zstandard package)"
+)
+@click.option(
+    "--compression-level", type=int,
+    default=None,
+    help="Compression level (defaults to the maximum for gzip and to 19 for zstd)"
+)
+@click.option(
+    "-j", "--jobs", type=int,
+    default=None,
+    help="Number of processes rendering collection documents (defaults to the number of CPUs)"
+)
+@click.option(
+    "--read-threads", type=click.IntRange(min=1),
+    default=None,
+    help="Number of threads reading the clusters of RNTuple inputs in parallel (defaults to 1, reading whole fields)"
+)
+@click.option(
+    "--incremental", is_flag=True,
+    default=False,
+    help="Only recompute collections whose inputs changed since the previous run in the same report directory"
+)
+@click.option(
+    "--sketch-size", type=click.IntRange(min=2),
+    default=None,
+    help="Read leaves one RNTuple cluster or TTree basket at a time into mergeable quantile sketches of about N values per level, bounding the memory and the time spent in the tests; leaves with more than N values per file get approximate histograms and KS and Anderson-Darling tests (the KS p-values are conservative, the AD ones approximate)"
+)
+@click.option(
+    "--profile-out", type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write a Chrome trace (chrome://tracing, Perfetto) with the time, CPU time, bytes read and memory spent per phase, collection and leaf"
+)
+@click.option(
+    "--profile-top", type=int,
+    default=20,
+    help="Number of slowest leaves and collections listed with --profile-out"
+)
+@click.option(
+    "--max-events", type=click.IntRange(min=1),
+    default=None,
+    help="Only compare the N events with the lowest event numbers, for a quick preview (this reads up to the last of them in every file, which saves little for files with shuffled or merged events)"
+)
+@click.option(
+    "--progressive", is_flag=True,
+    default=False,
+    help="After the --max-events preview, refine the report with ten times more events per pass, ending with all events"
+)
+@click.option(
+    "--trend-db", type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Append the histogram, statistics and p-values of every leaf of the last file to a SQLite database for \"capybara trend\" (collections skipped by --incremental are not recorded)"
+)
+@click.option(
+    "--trend-commit", envvar="GITHUB_SHA",
+    default=None,
+    help="Commit SHA to record with --trend-db (defaults to $GITHUB_SHA)"
+)
+@click.option(
+    "--trend-artifact",
+    default=None,
+    help="Artifact name to record with --trend-db (defaults to the name of the last file)"
+)
+def bara(files, match, unmatch, serve, pack, compression, compression_level, jobs, read_threads, incremental, sketch_size, profile_out, profile_top, max_events, progressive, trend_db, trend_commit, trend_artifact):
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise click.UsageError("--compression zstd requires the zstandard package (pip install epic-capybara[zstd])")
+    if progressive and max_events is None:
+        raise click.UsageError("--progressive requires --max-events")
+    if trend_db is not None:
+        if trend_commit is None:
+            raise click.UsageError("--trend-db requires --trend-commit")
+        if max_events is not None and not progressive:
+            raise click.UsageError("--trend-db only records comparisons of all events, it can not be used with a --max-events preview")
+        if not files:
+            raise click.UsageError("--trend-db requires files to compare")
+
+    output_dir = "capybara-reports"
+
+    match = list(map(re.compile, match))
+    unmatch = list(map(re.compile, unmatch))
+
+    passes = [max_events]
+    if progressive:
+        num_entries = 0
+        for path in files:
+            with uproot.open(path) as _file:
+                num_entries = max(num_entries, _file["events"].num_entries)
+        passes = list(takewhile(lambda n: n < num_entries, _progressive_steps(max_events))) + [None]
+
+    trend_store = None
+    if trend_db is not None:
+        trend_store = TrendStore(trend_db)
+        trend_artifact = trend_artifact or os.path.basename(files[-1])
+
+    server = None
+    profiler = Profiler(trace=True) if profile_out is not None else None
+    # without --profile-out, keep reporting to a profiler activated by the
+    # caller, e.g. the benchmarks
+    with activate(profiler) if profiler is not None else nullcontext():
+        for pass_max_events in passes:
+            if len(passes) > 1:
+                click.secho(
+                    "Comparing all events" if pass_max_events is None else f"Comparing at most {pass_max_events} events",
+                    fg="green", err=True,
+                )
+            trend = None
+            if trend_store is not None and pass_max_events is None:
+                trend = trend_store.recorder(trend_commit, trend_artifact)
+            summary = _make_report(
+                files, match, unmatch, output_dir, pack, compression, compression_level, jobs, incremental,
+                max_events=pass_max_events, trend=trend, read_threads=read_threads, sketch_size=sketch_size,
+            )
+            if serve and server is None and pass_max_events is not None:
+                # serve the preview while it is being refined
+                server = threading.Thread(target=serve_report, args=(output_dir,), daemon=True)
+                server.start()
+    if trend_store is not None:
+        trend_store.close()
+    if profiler is not None:
+        profiler.write_trace(profile_out, top=profile_top)
+        click.echo(profiler.summary(top=profile_top), err=True)
 
     if serve:
-        os.chdir("capybara-reports/")
-        from http.server import SimpleHTTPRequestHandler
-        from socketserver import TCPServer
-        with TCPServer(("127.0.0.1", 24535), SimpleHTTPRequestHandler) as httpd:
-            print("Serving report at http://127.0.0.1:24535")
+        if server is None:
+            serve_report(output_dir)
+        else:
             try:
-                httpd.serve_forever()
+                while server.is_alive():
+                    server.join(1)
             except KeyboardInterrupt:
                 pass
+
+    # returned by bara.main(..., standalone_mode=False), e.g. for benchmarks
+    return summary
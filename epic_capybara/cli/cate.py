@@ -1,3 +1,4 @@
+import hashlib
 import shutil
 import subprocess
 from github import Auth, Github, GithubException
@@ -6,7 +7,8 @@ from pathlib import Path
 import click
 from urllib.parse import urlparse
 
-from ..filesystem import hashdir
+from ..filesystem import ALGORITHMS, DEFAULT_ALGORITHM, hashdir
+from ..publish import publish_report
 from ..util import get_cache_dir
 
 
@@ -14,9 +16,12 @@ from ..util import get_cache_dir
 @click.option('--token', envvar="GITHUB_TOKEN", required=True, help="GitHub access token (defaults to GITHUB_TOKEN environment variable)")
 @click.option('--owner', help="Owner of the target repository (token owner by default)")
 @click.option('--repo', default="capybara-reports", help="Name of the target repository")
+@click.option('--hash-algorithm', default=DEFAULT_ALGORITHM, type=click.Choice(ALGORITHMS), help="Digest used to derive the report prefix")
+@click.option('--jobs', '-j', type=int, default=None, help="Number of threads used to hash the report")
+@click.option('--dedup', is_flag=True, default=False, help="Store report data files content-addressed, only committing files not yet in the repository")
 @click.argument('report-dir', type=click.Path(exists=True, file_okay=False, dir_okay=True))
 @click.pass_context
-def cate(ctx: click.Context, owner: str, repo: str, report_dir: str, token: str):
+def cate(ctx: click.Context, owner: str, repo: str, report_dir: str, token: str, hash_algorithm: str, jobs: int, dedup: bool):
     gh = Github(auth=Auth.Token(token))
 
     if owner is not None:
@@ -32,23 +37,40 @@ def cate(ctx: click.Context, owner: str, repo: str, report_dir: str, token: str)
 
     report_dir = Path(report_dir)
 
-    prefix = hashdir(report_dir)
+    # The manifest lives outside of the report, so that it does not affect the prefix
+    manifest_name = hashlib.blake2b(str(report_dir.resolve()).encode(), digest_size=16).hexdigest()
+    file_digests = {}
+    prefix = hashdir(
+        report_dir,
+        algorithm=hash_algorithm,
+        manifest=get_cache_dir() / "hashdir" / f"{manifest_name}.json",
+        jobs=jobs,
+        file_digests=file_digests,
+    )
 
     clone_url = urlparse(repo.clone_url)
     # Add authentication information
     clone_url = clone_url._replace(
         netloc=f"{user.login}:{token}@{clone_url.netloc}",
     )
-    local_repo = get_cache_dir() / user.login / repo.name
 
-    if not local_repo.exists():
-        subprocess.check_output(["git", "clone", clone_url.geturl(), str(local_repo)])
+    if dedup:
+        new_blobs = publish_report(
+            report_dir, clone_url.geturl(), prefix,
+            algorithm=hash_algorithm, file_digests=file_digests,
+        )
+        click.secho(f"Committed {len(new_blobs)} new blob(s)", fg="green", err=True)
     else:
-        subprocess.check_output(["git", "-C", str(local_repo), "pull"])
-    shutil.copytree(report_dir, local_repo / prefix)
-    subprocess.check_output(["git", "-C", str(local_repo), "add", prefix])
-    subprocess.check_output(["git", "-C", str(local_repo), "commit", "-m", f"Adding {prefix}/"])
-    subprocess.check_output(["git", "-C", str(local_repo), "push"])
+        local_repo = get_cache_dir() / user.login / repo.name
+
+        if not local_repo.exists():
+            subprocess.check_output(["git", "clone", clone_url.geturl(), str(local_repo)])
+        else:
+            subprocess.check_output(["git", "-C", str(local_repo), "pull"])
+        shutil.copytree(report_dir, local_repo / prefix)
+        subprocess.check_output(["git", "-C", str(local_repo), "add", prefix])
+        subprocess.check_output(["git", "-C", str(local_repo), "commit", "-m", f"Adding {prefix}/"])
+        subprocess.check_output(["git", "-C", str(local_repo), "push"])
 
     try:
         file = repo.get_contents(".nojekyll")
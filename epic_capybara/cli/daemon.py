@@ -0,0 +1,160 @@
+import os
+
+import click
+
+from ..daemon import DEFAULT_CACHE_SIZE, LRUCache, make_server, parse_size, request
+from ..report import DOCUMENT_SUFFIXES
+from ..util import get_cache_dir
+
+
+def _connection_options(f):
+    f = click.option(
+        "--socket", "socket_path", type=click.Path(dir_okay=False),
+        default=lambda: str(get_cache_dir() / "daemon.sock"),
+        show_default="~/.cache/epic-capybara/daemon.sock",
+        help="Unix socket of the daemon"
+    )(f)
+    return f
+
+
+def _request(method, path, data, socket_path):
+    try:
+        status, reply = request(method, path, data, socket_path=socket_path)
+    except OSError as e:
+        raise click.ClickException(f"Unable to reach the daemon: {e}")
+    if status != 200:
+        raise click.ClickException(reply.get("error", f"HTTP status {status}"))
+    return reply
+
+
+@click.group()
+def daemon():
+    """Keep decoded input files in memory between comparisons.
+
+    Start the daemon with `capybara daemon run`, then submit comparisons
+    with `capybara daemon submit`. Files compared repeatedly, e.g. the
+    reference of many PR comparisons, are only read once.
+    """
+    pass
+
+
+@daemon.command()
+@_connection_options
+@click.option(
+    "--cache-size", default=DEFAULT_CACHE_SIZE, show_default=True,
+    help="Memory budget for decoded leaves, e.g. 512M or 4G"
+)
+def run(socket_path, cache_size):
+    """Run the daemon in the foreground."""
+    try:
+        max_bytes = parse_size(cache_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--cache-size")
+    try:
+        server = make_server(LRUCache(max_bytes), socket_path=socket_path)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Listening on {socket_path}", err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+@daemon.command()
+@click.argument("files", type=click.Path(exists=True, dir_okay=False), nargs=-1, required=True)
+@click.option(
+    "-m", "--match", multiple=True,
+    help="Only include collections with names matching a regex"
+)
+@click.option(
+    "-M", "--unmatch", multiple=True,
+    help="Exclude collections with names matching a regex"
+)
+@click.option(
+    "-o", "--output-dir", type=click.Path(file_okay=False),
+    default="capybara-reports", show_default=True,
+    help="Report directory"
+)
+@click.option(
+    "--pack", is_flag=True,
+    default=False,
+    help="Store all collections in a single pack file with an index, instead of one file per collection"
+)
+@click.option(
+    "--compression", type=click.Choice(sorted(DOCUMENT_SUFFIXES)),
+    default="gzip",
+    help="Compression of the per-collection documents (zstd requires the zstandard package)"
+)
+@click.option(
+    "--compression-level", type=int,
+    default=None,
+    help="Compression level (defaults to the maximum for gzip and to 19 for zstd)"
+)
+@click.option(
+    "-j", "--jobs", type=int,
+    default=None,
+    help="Number of processes rendering collection documents (defaults to the number of CPUs)"
+)
+@click.option(
+    "--read-threads", type=click.IntRange(min=1),
+    default=None,
+    help="Number of threads reading the clusters of RNTuple inputs in parallel (defaults to 1, reading whole fields)"
+)
+@click.option(
+    "--incremental", is_flag=True,
+    default=False,
+    help="Only recompute collections whose inputs changed since the previous run in the same report directory"
+)
+@click.option(
+    "--sketch-size", type=click.IntRange(min=2),
+    default=None,
+    help="Read leaves one RNTuple cluster or TTree basket at a time into mergeable quantile sketches of about N values per level, bounding the memory and the time spent in the tests; leaves with more than N values per file get approximate histograms and KS and Anderson-Darling tests (the KS p-values are conservative, the AD ones approximate)"
+)
+@click.option(
+    "--max-events", type=click.IntRange(min=1),
+    default=None,
+    help="Only compare the N events with the lowest event numbers, for a quick preview (this reads up to the last of them in every file, which saves little for files with shuffled or merged events)"
+)
+@_connection_options
+def submit(files, match, unmatch, output_dir, pack, compression, compression_level, jobs, read_threads, incremental, sketch_size, max_events, socket_path):
+    """Compare files like `capybara bara`, in the daemon."""
+    job = {
+        # the daemon may run in a different working directory
+        "files": [os.path.abspath(path) for path in files],
+        "match": list(match),
+        "unmatch": list(unmatch),
+        "output_dir": os.path.abspath(output_dir),
+        "pack": pack,
+        "compression": compression,
+        "compression_level": compression_level,
+        "jobs": jobs,
+        "read_threads": read_threads,
+        "incremental": incremental,
+        "sketch_size": sketch_size,
+        "max_events": max_events,
+    }
+    reply = _request("POST", "/jobs", job, socket_path)
+    click.echo(reply["log"], nl=False)
+    click.echo(f"Report written to {job['output_dir']}", err=True)
+
+
+@daemon.command()
+@_connection_options
+def status(socket_path):
+    """Show the cache usage of the daemon."""
+    reply = _request("GET", "/status", None, socket_path)
+    cache = reply["cache"]
+    click.echo(f"pid {reply['pid']}")
+    click.echo(f"{cache['entries']} cached values, {cache['nbytes'] / 2**20:.1f} of {cache['max_bytes'] / 2**20:.1f} MiB")
+    click.echo(f"{cache['hits']} hits, {cache['misses']} misses")
+
+
+@daemon.command()
+@_connection_options
+def stop(socket_path):
+    """Stop the daemon."""
+    _request("POST", "/shutdown", None, socket_path)
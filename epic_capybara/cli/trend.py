@@ -0,0 +1,57 @@
+import datetime
+
+import click
+
+from ..render import write_trend
+from ..trend import TrendStore
+
+
+def _format(value, spec):
+    return "" if value is None else format(value, spec)
+
+
+@click.command()
+@click.argument("database", type=click.Path(exists=True, dir_okay=False))
+@click.argument("key", required=False)
+@click.option("--artifact", help="Artifact to show (required if the database holds several)")
+@click.option("--limit", type=click.IntRange(min=1), default=None, help="Only show the N most recent commits")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True), default=None, help="Write an HTML plot of the history")
+def trend(database, key, artifact, limit, output):
+    """Show the history of a leaf recorded with "bara --trend-db".
+
+    Without KEY, list the recorded artifacts and keys.
+    """
+    store = TrendStore(database)
+    try:
+        if artifact is None:
+            artifacts = store.artifacts()
+            if len(artifacts) == 1:
+                artifact, = artifacts
+            elif key is not None:
+                raise click.UsageError(f"--artifact is required, the database holds {', '.join(artifacts) or 'no artifacts'}")
+
+        if key is None:
+            for listed_artifact in [artifact] if artifact is not None else store.artifacts():
+                click.echo(f"{listed_artifact}:")
+                for listed_key in store.keys(listed_artifact):
+                    click.echo(f"  {listed_key}")
+            return
+
+        rows = store.history(artifact, key, limit=limit)
+        if not rows:
+            raise click.UsageError(f"No history for \"{key}\" in {artifact}")
+
+        click.echo(f"{'commit':12} {'recorded':19} {'entries':>9} {'mean':>11} {'std':>11} {'p_KS':>6} {'p_AD':>6}")
+        for row in rows:
+            recorded = datetime.datetime.fromtimestamp(row["recorded_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            click.echo(
+                f"{row['commit_sha'][:12]:12} {recorded:19} {row['entries']:9d}"
+                f" {_format(row['mean'], '11.4g'):>11} {_format(row['std'], '11.4g'):>11}"
+                f" {_format(row['ks_pvalue'], '6.3f'):>6} {_format(row['ad_pvalue'], '6.3f'):>6}"
+            )
+
+        if output is not None:
+            write_trend(output, artifact, key, rows)
+            click.secho(f"Wrote {output}", fg="green", err=True)
+    finally:
+        store.close()
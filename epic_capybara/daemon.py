@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stderr, redirect_stdout
+from http import HTTPStatus
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+from io import StringIO
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+
+DEFAULT_CACHE_SIZE = "2G"
+
+_SIZE_SUFFIXES = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size):
+    """
+    >>> parse_size("512M"), parse_size("2G"), parse_size("1000")
+    (536870912, 2147483648, 1000)
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size \"{size}\"")
+    value, suffix = match.groups()
+    return int(float(value) * _SIZE_SUFFIXES[suffix.upper()])
+
+
+def nbytes(value):
+    """Approximate the memory held by a cached value."""
+    if hasattr(value, "nbytes"):
+        # awkward and numpy arrays
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(key) + sys.getsizeof(val) for key, val in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """A cache that evicts the least recently used values once their total
+    size exceeds `max_bytes`.
+
+    >>> import numpy as np
+    >>> cache = LRUCache(max_bytes=100)
+    >>> cache.put("a", np.zeros(10))
+    >>> cache.put("b", np.zeros(5))
+    >>> cache.get("a") is None, cache.get("b") is None
+    (True, False)
+    >>> cache.stats()["nbytes"]
+    40
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, _ = self._values[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        with self._lock:
+            if key in self._values:
+                self.nbytes -= self._values.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self.nbytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._values.popitem(last=False)
+                self.nbytes -= evicted_size
+            self._values[key] = (value, size)
+            self.nbytes += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._values),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def run_job(job, cache):
+    """Run a comparison job, return the summary table and the output."""
+    # imported here, since epic_capybara.cli imports the daemon command
+    from .cli.bara import _make_report
+
+    files = job["files"]
+    if not files or not all(isinstance(path, str) for path in files):
+        raise ValueError("\"files\" must be a non-empty list of paths")
+    log = StringIO()
+    with redirect_stdout(log), redirect_stderr(log):
+        summary = _make_report(
+            files,
+            [re.compile(pattern) for pattern in job.get("match", [])],
+            [re.compile(pattern) for pattern in job.get("unmatch", [])],
+            job.get("output_dir", "capybara-reports"),
+            pack=job.get("pack", False),
+            compression=job.get("compression", "gzip"),
+            compression_level=job.get("compression_level"),
+            jobs=job.get("jobs"),
+            incremental=job.get("incremental", False),
+            cache=cache,
+            max_events=job.get("max_events"),
+            read_threads=job.get("read_threads"),
+            sketch_size=job.get("sketch_size"),
+            # forking the threaded server is not safe
+            mp_context="spawn",
+        )
+    return {"summary": summary, "log": log.getvalue()}
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """Accept comparison jobs as JSON.
+
+    POST /jobs runs a job (see run_job), GET /status returns cache
+    statistics and POST /shutdown stops the daemon. Jobs run one at a time,
+    since they share the cache and the process-wide standard streams.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # client_address is empty for Unix sockets
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        # jobs redirect sys.stderr to capture their output
+        sys.__stderr__.write(f"{self.address_string()} - [{self.log_date_time_string()}] {format % args}\n")
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(HTTPStatus.OK, {"pid": os.getpid(), "cache": self.server.cache.stats()})
+        else:
+            self._reply(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path == "/shutdown":
+            self._reply(HTTPStatus.OK, {})
+            threading.Thread(target=self.server.shutdown).start()
+        elif self.path == "/jobs":
+            try:
+                job = json.loads(body)
+            except ValueError as e:
+                self._reply(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+                return
+            with self.server.job_lock:
+                try:
+                    result = run_job(job, self.server.cache)
+                except (KeyError, ValueError, TypeError, re.error, OSError) as e:
+                    self._reply(HTTPStatus.BAD_REQUEST, {"error": f"{type(e).__name__}: {e}"})
+                    return
+                except Exception:
+                    self._reply(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": traceback.format_exc()})
+                    return
+            self._reply(HTTPStatus.OK, result)
+        else:
+            self._reply(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def make_server(cache, socket_path):
+    """Create a daemon listening on a Unix socket.
+
+    Jobs read and write any path the daemon can, so the socket is only
+    accessible to the user running the daemon (mode 0600).
+    """
+    socket_path = os.fspath(socket_path)
+    if os.path.exists(socket_path):
+        # remove the socket of a daemon that did not exit cleanly
+        probe = _UnixHTTPConnection(socket_path, timeout=1)
+        try:
+            probe.connect()
+        except OSError:
+            os.remove(socket_path)
+        else:
+            probe.close()
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    # the socket is created by bind(), with permissions from the umask
+    umask = os.umask(0o177)
+    try:
+        server = _UnixHTTPServer(socket_path, DaemonRequestHandler)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.cache = cache
+    server.job_lock = threading.Lock()
+    return server
+
+
+def request(method, path, data=None, socket_path=None):
+    """Send a request to a daemon and return the status and the decoded reply."""
+    connection = _UnixHTTPConnection(os.fspath(socket_path))
+    try:
+        body = None if data is None else json.dumps(data).encode()
+        connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
@@ -1,21 +1,179 @@
 import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
-def hashdir(path):
-    digest = hashlib.md5()
+# Files are streamed through the digest in chunks of this size, so that peak
+# memory does not depend on the size of the largest report file.
+_CHUNK_SIZE = 1 << 20
 
-    def recurse(cur_path, digest=None):
-        paths = cur_path.iterdir()
-        for file_ in sorted([p for p in paths if p.is_file()]):
-            digest.update(str(file_.relative_to(path)).encode())
-            with open(file_, "rb") as fp:
-                digest.update(fp.read())
+DEFAULT_ALGORITHM = "blake2b"
 
-        paths = cur_path.iterdir()
-        for dir_ in sorted([p for p in paths if p.is_dir()]):
-            recurse(dir_, digest)
+# shake_128 and shake_256 are left out, their digests have no fixed length
+ALGORITHMS = sorted(
+    algorithm for algorithm in hashlib.algorithms_guaranteed
+    if not algorithm.startswith("shake_")
+)
 
-    recurse(path, digest)
+
+def _new_digest(algorithm):
+    """
+    >>> _new_digest("sha256").hexdigest()[:16]
+    'e3b0c44298fc1c14'
+    >>> _new_digest("shake_128")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsupported digest algorithm "shake_128"
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unsupported digest algorithm \"{algorithm}\"")
+    if algorithm == "blake2b":
+        # 128 bits keeps the prefixes as long as the historical MD5 ones
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.new(algorithm)
+
+
+def hashfile(path, algorithm=DEFAULT_ALGORITHM):
+    """Return the hex digest of a file's contents, read in fixed-size chunks.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     _ = (Path(tmp) / "a.txt").write_bytes(b"capybara")
+    ...     hashfile(Path(tmp) / "a.txt", algorithm="md5")
+    '2e6380b6537c5fce2bb321b48bf0785d'
+    """
+    with open(path, "rb") as fp:
+        return hashfileobj(fp, algorithm)
+
+
+def hashfileobj(fp, algorithm=DEFAULT_ALGORITHM):
+    """Return the hex digest of the rest of a binary file object.
+
+    >>> import io
+    >>> hashfileobj(io.BytesIO(b"capybara"), algorithm="md5")
+    '2e6380b6537c5fce2bb321b48bf0785d'
+    >>> [len(hashfileobj(io.BytesIO(b"capybara"), algorithm=algorithm)) for algorithm in ["sha1", "sha3_256", "sha512"]]
+    [40, 64, 128]
+    """
+    digest = _new_digest(algorithm)
+    for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan(root, cur=""):
+    """Yield (relative POSIX path, os.stat_result) for every file under root.
+
+    Each directory is listed exactly once, and the stat information comes
+    from the same listing.
+    """
+    with os.scandir(os.path.join(root, cur)) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        rel_path = f"{cur}/{entry.name}" if cur else entry.name
+        if entry.is_dir():
+            yield from _scan(root, rel_path)
+        elif entry.is_file():
+            yield rel_path, entry.stat()
+
+
+def _load_manifest(manifest, algorithm):
+    try:
+        with open(manifest) as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if data.get("algorithm") != algorithm:
+        return {}
+    return data.get("files", {})
+
+
+def _save_manifest(manifest, algorithm, files):
+    manifest = Path(manifest)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest.with_name(manifest.name + ".tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump({"algorithm": algorithm, "files": files}, fp, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest)
+
+
+def hashdir(path, algorithm=DEFAULT_ALGORITHM, manifest=None, jobs=None, file_digests=None):
+    """Return a digest identifying the contents of a directory tree.
+
+    The digest is computed in two stages. First, every regular file is
+    hashed on its own (in parallel, using `jobs` threads). Then the per-file
+    digests are combined, in order of the files' relative POSIX paths, as
+
+        H(path_1 + "\\0" + digest_1 + "\\n" + path_2 + "\\0" + digest_2 + "\\n" + ...)
+
+    where H is `algorithm` (128-bit BLAKE2b by default). The result depends
+    only on the file names and contents, not on the platform, the directory
+    listing order or the number of workers, so it can be used as a stable
+    prefix for published reports.
+
+    If `manifest` is given, it names a JSON file recording the size,
+    modification time and digest of every file from the previous call.
+    Files whose size and modification time did not change are not read
+    again, which makes rehashing an unchanged directory nearly free.
+
+    If `file_digests` is a dict, the digest of every file is stored in it
+    under the file's relative POSIX path, e.g. to be reused by
+    epic_capybara.publish.publish_report.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     tmp = Path(tmp)
+    ...     (tmp / "sub").mkdir()
+    ...     _ = (tmp / "index.html").write_text("<html></html>")
+    ...     _ = (tmp / "sub" / "a.json.gz").write_bytes(b"\\x1f\\x8b")
+    ...     first = hashdir(tmp, manifest=tmp / "sub" / "manifest.json")
+    ...     second = hashdir(tmp, manifest=tmp / "sub" / "manifest.json", jobs=1)
+    ...     first == second, len(first)
+    (True, 32)
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     _ = (Path(tmp) / "index.html").write_text("<html></html>")
+    ...     file_digests = {}
+    ...     hashdir(Path(tmp), algorithm="md5", file_digests=file_digests), file_digests
+    ('be29f74c4a6ae2350c399b91f11628a6', {'index.html': 'c83301425b2ad1d496473a5ff3d9ecca'})
+    """
+    path = Path(path)
+    skip = None
+    if manifest is not None:
+        try:
+            skip = Path(manifest).resolve().relative_to(path.resolve()).as_posix()
+        except ValueError:
+            pass
+        known = _load_manifest(manifest, algorithm)
+    else:
+        known = {}
+
+    files = [(rel_path, stat) for rel_path, stat in _scan(path) if rel_path != skip]
+    # the scan is sorted per directory component, make the global order explicit
+    files.sort(key=lambda item: item[0])
+
+    def digest_of(item):
+        rel_path, stat = item
+        entry = known.get(rel_path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return hashfile(path / rel_path, algorithm)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        digests = list(executor.map(digest_of, files))
+
+    digest = _new_digest(algorithm)
+    for (rel_path, _), file_digest in zip(files, digests):
+        digest.update(f"{rel_path}\0{file_digest}\n".encode())
+
+    if file_digests is not None:
+        file_digests.update((rel_path, file_digest) for (rel_path, _), file_digest in zip(files, digests))
+
+    if manifest is not None:
+        _save_manifest(manifest, algorithm, {
+            rel_path: [stat.st_size, stat.st_mtime_ns, file_digest]
+            for (rel_path, stat), file_digest in zip(files, digests)
+        })
 
     return digest.hexdigest()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import awkward as ak
+
+from .__about__ import __version__
+from .filesystem import hashfile
+from .report import atomic_write
+
+
+# Stored in the report directory, maps every collection to the digest of
+# its inputs and to its summary table entry.
+MANIFEST_FILENAME = "capybara-incremental.json"
+
+_MANIFEST_VERSION = 1
+
+
+def code_version():
+    """Return an identifier of the code producing the reports.
+
+    Besides the release version, this covers the package sources, so that
+    development checkouts do not reuse outputs of a different revision.
+    """
+    digest = hashlib.blake2b(__version__.encode(), digest_size=16)
+    package_dir = Path(__file__).parent
+    for path in sorted(package_dir.rglob("*.py")):
+        digest.update(path.relative_to(package_dir).as_posix().encode())
+        digest.update(hashfile(path).encode())
+    return digest.hexdigest()
+
+
+def update_leaf_digest(digest, obj):
+    """Feed the stored contents of a TTree branch or an RNTuple field into a
+    digest.
+
+    For TTree branches the compressed basket payloads are hashed without
+    decompressing them. The TKey headers are skipped, since they contain
+    write timestamps. For other objects the decoded values are hashed, and
+    the decoded array is returned so that the caller can reuse it.
+    """
+    if not hasattr(obj, "basket_key"):
+        array = obj.array()
+        form, length, container = ak.to_buffers(array)
+        digest.update(f"{form.to_json()}:{length}".encode())
+        for name in sorted(container):
+            digest.update(name.encode())
+            digest.update(memoryview(container[name]).cast("B"))
+        return array
+
+    digest.update(f"{obj.typename}:{obj.num_entries}:{obj.num_baskets}".encode())
+    digest.update(obj.member("fBasketEntry").tobytes())
+    for basket_num in range(obj.num_baskets):
+        try:
+            key = obj.basket_key(basket_num)
+        except ValueError:
+            # embedded basket, its contents are a part of the TBranch metadata
+            digest.update(obj.basket(basket_num).data.tobytes())
+            continue
+        start = int(obj.member("fBasketSeek")[basket_num]) + key.fKeylen
+        stop = int(obj.member("fBasketSeek")[basket_num]) + obj.basket_compressed_bytes(basket_num)
+        digest.update(obj.file.source.chunk(start, stop).raw_data.tobytes())
+    return None
+
+
+def load_manifest(output_dir, settings):
+    """Return the collections recorded by a previous run with the same settings."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != _MANIFEST_VERSION or manifest.get("settings") != settings:
+        return {}
+    return manifest.get("collections", {})
+
+
+def save_manifest(output_dir, settings, collections):
+    """Record the input digest and summary entry of every collection.
+
+    `collections` maps collection names to dicts with "digest", "filename"
+    and "summary" keys.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     save_manifest(tmp, {"pack": False}, {"Hits": {"digest": "00"}})
+    ...     load_manifest(tmp, {"pack": False}), load_manifest(tmp, {"pack": True})
+    ({'Hits': {'digest': '00'}}, {})
+    """
+    manifest = {
+        "version": _MANIFEST_VERSION,
+        "settings": settings,
+        "collections": dict(sorted(collections.items())),
+    }
+    atomic_write(
+        os.path.join(output_dir, MANIFEST_FILENAME),
+        json.dumps(manifest, indent=1, sort_keys=True).encode(),
+    )
+
+
+def remove_manifest(output_dir):
+    """Forget the recorded collections, e.g. after a non-incremental run
+    overwrote the documents."""
+    try:
+        os.remove(os.path.join(output_dir, MANIFEST_FILENAME))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# The profiler that phase() reports to, None when not profiling
+_active = None
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def _rss():
+    """Return the resident set size of this process in bytes, None if
+    unavailable."""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Profiler:
+    """Accumulate wall and CPU time spent in each phase of a run.
+
+    Spans are grouped by category: "phase" for the kind of work (reading,
+    sorting, statistical tests, ...), "leaf" and "collection" for what the
+    work was done on. With `trace`, every span is also recorded as a Chrome
+    trace event, together with the change of the resident set size and of
+    the registered counters.
+
+    >>> profiler = Profiler(trace=True)
+    >>> with activate(profiler):
+    ...     register_counter("bytes_read", lambda: 42)
+    ...     with phase("MCParticles.PDG", category="leaf"):
+    ...         with phase("read"):
+    ...             pass
+    ...         with phase("read"):
+    ...             pass
+    >>> profiler.phases["read"]["count"]
+    2
+    >>> profiler.totals["leaf"]["MCParticles.PDG"]["bytes_read"]
+    0
+    >>> [event["name"] for event in profiler.trace()["traceEvents"]]
+    ['read', 'read', 'MCParticles.PDG']
+    """
+
+    def __init__(self, trace=False):
+        self.trace_events = trace
+        # category -> name -> {"count", "wall", "cpu", ...}
+        self.totals = {}
+        self.events = []
+        self.counters = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def phases(self):
+        return self.totals.get("phase", {})
+
+    def register_counter(self, name, fn):
+        """Report the change of a cumulative value, e.g. bytes read, for
+        every span."""
+        self.counters[name] = fn
+
+    def _sample(self):
+        sample = {name: fn() for name, fn in self.counters.items()}
+        if self.trace_events:
+            sample["rss"] = _rss()
+        return sample
+
+    @contextmanager
+    def phase(self, name, category="phase", **args):
+        start_sample = self._sample()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_stop = time.perf_counter()
+            cpu = time.process_time() - cpu_start
+            stop_sample = self._sample()
+            deltas = {
+                key: stop_sample[key] - start_sample[key]
+                for key in stop_sample
+                if start_sample[key] is not None and stop_sample[key] is not None
+            }
+            with self._lock:
+                stats = self.totals.setdefault(category, {}).setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0})
+                stats["count"] += 1
+                stats["wall"] += wall_stop - wall_start
+                stats["cpu"] += cpu
+                for key, delta in deltas.items():
+                    stats[key] = stats.get(key, 0) + delta
+                if self.trace_events:
+                    self.events.append({
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": (wall_start - self._origin) * 1e6,
+                        "dur": (wall_stop - wall_start) * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": {"cpu_ms": cpu * 1e3, **deltas, **args},
+                    })
+
+    def slowest(self, category, top=None):
+        """Return (name, stats) pairs of a category, slowest first."""
+        items = sorted(self.totals.get(category, {}).items(), key=lambda item: -item[1]["wall"])
+        return items if top is None else items[:top]
+
+    def trace(self, top=20):
+        """Return the run in the Chrome trace event format.
+
+        Besides the events, "otherData" holds the phase totals and the `top`
+        slowest leaves and collections.
+        """
+        return {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "phases": dict(self.slowest("phase")),
+                "slowest_leaves": self.slowest("leaf", top),
+                "slowest_collections": self.slowest("collection", top),
+            },
+        }
+
+    def write_trace(self, path, top=20):
+        with open(path, "w") as fp:
+            json.dump(self.trace(top=top), fp)
+
+    def summary(self, top=20):
+        """Return a human readable table of the phase totals and of the `top`
+        slowest collections and leaves."""
+        lines = []
+        for category, title in [("phase", "Phases"), ("collection", "Slowest collections"), ("leaf", "Slowest leaves")]:
+            items = self.slowest(category, None if category == "phase" else top)
+            if not items:
+                continue
+            lines.append(f"{title}:")
+            lines.append(f"  {'wall [s]':>9} {'cpu [s]':>9} {'read [MB]':>9} {'rss [MB]':>9}  name")
+            for name, stats in items:
+                bytes_read = stats.get("bytes_read")
+                rss = stats.get("rss")
+                lines.append(
+                    f"  {stats['wall']:9.3f} {stats['cpu']:9.3f}"
+                    f" {'' if bytes_read is None else format(bytes_read / 1e6, '.2f'):>9}"
+                    f" {'' if rss is None else format(rss / 1e6, '+.1f'):>9}"
+                    f"  {name}"
+                )
+        return "\n".join(lines)
+
+
+@contextmanager
+def activate(profiler):
+    """Make phase() report to `profiler` for the duration of the block."""
+    global _active
+    previous = _active
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+
+@contextmanager
+def phase(name, category="phase", **args):
+    """Attribute the time spent in the block to a span of the active
+    profiler. Extra keyword arguments are recorded with the trace event."""
+    if _active is None:
+        yield
+        return
+    with _active.phase(name, category, **args):
+        yield
+
+
+def register_counter(name, fn):
+    """Register a counter with the active profiler, if any."""
+    if _active is not None:
+        _active.register_counter(name, fn)
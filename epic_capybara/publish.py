@@ -0,0 +1,133 @@
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+from .filesystem import DEFAULT_ALGORITHM, hashfile
+
+
+# Per-report mapping from file names to their location in the blob store,
+# read by the report's JavaScript loader.
+LINKS_FILENAME = "capybara-links.json"
+
+BLOBS_DIR = "blobs"
+
+
+def _git(repo, *args, input=None):
+    return subprocess.check_output(
+        ["git", "-C", str(repo), *args],
+        input=input,
+        text=True,
+    )
+
+
+def _blob_path(report_file, digest):
+    """Return the content-addressed location of a report file in the repository.
+
+    The file suffixes are kept, so that the web server picks the right
+    content type.
+
+    >>> _blob_path(Path("MCParticles.json.gz"), "0123abcd")
+    'blobs/01/0123abcd.json.gz'
+    """
+    return f"{BLOBS_DIR}/{digest[:2]}/{digest}{''.join(report_file.suffixes)}"
+
+
+def _is_blob(rel_path):
+    # HTML pages need to stay at their URL to be browsable
+    return not rel_path.name.endswith(".html")
+
+
+def publish_report(report_dir, remote_url, prefix, message=None, algorithm=DEFAULT_ALGORITHM, file_digests=None):
+    """Commit a report to a git repository, storing its data files only once.
+
+    Data files are stored content-addressed under `blobs/`, shared by all
+    reports, and `<prefix>/capybara-links.json` maps their original names to
+    the shared copies. HTML pages are stored under `<prefix>/` directly.
+
+    The repository is cloned shallowly without blobs and without a
+    checkout, and the new commit is assembled with plumbing commands, so
+    neither the clone time nor the disk usage grows with the number of
+    published reports. Only blobs that are not in the repository yet end up
+    in the pushed commit.
+
+    Blobs are named by their `algorithm` digest. `file_digests` maps
+    relative POSIX paths of report files to those digests, as computed by
+    epic_capybara.filesystem.hashdir, files missing from it are hashed.
+
+    Returns the list of repository paths of newly added blobs.
+    """
+    report_dir = Path(report_dir)
+    if message is None:
+        message = f"Adding {prefix}/"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local_repo = Path(tmp) / "repo"
+        subprocess.check_output(
+            ["git", "clone", "--quiet", "--depth", "1", "--filter=blob:none", "--no-checkout", remote_url, str(local_repo)],
+            stderr=subprocess.STDOUT,
+        )
+        branch = _git(local_repo, "symbolic-ref", "--short", "HEAD").strip()
+        try:
+            parent = _git(local_repo, "rev-parse", "--verify", "--quiet", "HEAD").strip()
+        except subprocess.CalledProcessError:
+            # empty repository
+            parent = None
+
+        if parent is not None:
+            _git(local_repo, "read-tree", parent)
+            existing = set(_git(local_repo, "ls-tree", "-r", "--name-only", parent, "--", BLOBS_DIR).splitlines())
+        else:
+            existing = set()
+
+        files = sorted(
+            path.relative_to(report_dir)
+            for path in report_dir.rglob("*")
+            if path.is_file()
+        )
+
+        entries = {}
+        links = {}
+        new_blobs = []
+        for rel_path in files:
+            if _is_blob(rel_path):
+                digest = (file_digests or {}).get(rel_path.as_posix())
+                if digest is None:
+                    digest = hashfile(report_dir / rel_path, algorithm)
+                blob_path = _blob_path(rel_path, digest)
+                links[rel_path.as_posix()] = f"../{blob_path}"
+                if blob_path not in existing and blob_path not in entries:
+                    entries[blob_path] = report_dir / rel_path
+                    new_blobs.append(blob_path)
+            else:
+                entries[f"{prefix}/{rel_path.as_posix()}"] = report_dir / rel_path
+
+        links_path = Path(tmp) / LINKS_FILENAME
+        with open(links_path, "w") as fp:
+            json.dump(links, fp, indent=1, sort_keys=True)
+        entries[f"{prefix}/{LINKS_FILENAME}"] = links_path
+
+        repo_paths = list(entries.keys())
+        object_ids = _git(
+            local_repo, "hash-object", "-w", "--stdin-paths",
+            input="".join(f"{os.path.abspath(entries[path])}\n" for path in repo_paths),
+        ).split()
+        _git(
+            local_repo, "update-index", "--add", "--index-info",
+            input="".join(f"100644 {oid}\t{path}\n" for oid, path in zip(object_ids, repo_paths)),
+        )
+        # existing blobs are missing from the partial clone, checking for them
+        # would fetch them lazily
+        tree = _git(local_repo, "write-tree", "--missing-ok").strip()
+        commit = _git(
+            local_repo, "commit-tree", tree,
+            *(["-p", parent] if parent is not None else []),
+            "-m", message,
+        ).strip()
+        subprocess.check_output(
+            ["git", "-C", str(local_repo), "push", "--quiet", "origin", f"{commit}:refs/heads/{branch}"],
+            stderr=subprocess.STDOUT,
+        )
+
+    return new_blobs
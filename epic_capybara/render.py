@@ -0,0 +1,647 @@
+import json
+import multiprocessing
+import re
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from html import escape as escape_html
+
+import click
+import numpy as np
+from bokeh.document import Document
+from bokeh.embed import file_html, json_item
+from bokeh.events import DocumentReady
+from bokeh.layouts import column, gridplot
+from bokeh.models import (
+    ColumnDataSource,
+    CustomJS,
+    CustomJSExpr,
+    DataTable,
+    Div,
+    HoverTool,
+    HTMLTemplateFormatter,
+    NumberFormatter,
+    PrintfTickFormatter,
+    Range1d,
+    Select,
+    StringFormatter,
+    TableColumn,
+)
+from bokeh.models.comparisons import CustomJSCompare
+from bokeh.plotting import figure
+from bokeh.resources import CDN
+from bokeh.util import serialization as bokeh_serialization
+
+from .publish import LINKS_FILENAME
+from .report import DOCUMENT_SUFFIXES, PACK_INDEX_FILENAME, atomic_write, compress_document
+
+
+# Histograms are stored as integer counts, the error band is computed
+# client-side. `field` and `sign` are passed as CustomJSExpr args.
+_ERROR_BAND_EXPR_CODE = """
+return Float64Array.from(this.data[field], (v) => v + sign * Math.sqrt(v));
+"""
+
+# Browsers can not decompress zstd natively, zstd reports load this decoder
+_ZSTD_DECODER_URL = "https://cdn.jsdelivr.net/npm/fzstd@0.1.1/+esm"
+
+_VIS_PARAMS = [
+  ("green", 1.5, "solid", " "),
+  ("red", 3, "dashed", ","),
+  ("blue", 2, "dotted", "."),
+]
+
+_SELECT_TITLE = "Select branch (**** < 67% CL, ..., * > 99% CL stat. equiv.):"
+
+_SELECT_CALLBACK_CODE = """
+  console.log('dropdown: ' + this.value, this.toString())
+  if (this.value != "") {
+    window.location.hash = "#" + this.value;
+    fetchAndReplaceBokehDocument(this.value);
+  } else {
+    // Empty option selected: navigate back to the index page.
+    window.location.hash = "";
+  }
+"""
+
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _compact_array(values):
+    """Convert an array to the smallest dtype that represents it exactly and
+    that Bokeh can serialize as a binary buffer.
+
+    >>> _compact_array(np.array([0, 3, 7], dtype=np.int64)).dtype
+    dtype('int32')
+    >>> _compact_array(np.array([0., 0.5, 1.])).dtype
+    dtype('float32')
+    >>> _compact_array(np.array([0., 0.1, 0.2])).dtype
+    dtype('float64')
+    """
+    if values.dtype.kind in "iu":
+        if len(values) == 0 or (np.min(values) >= -2**31 and np.max(values) < 2**31):
+            return values.astype(np.int32)
+        return values.astype(np.float64)
+    single = values.astype(np.float32)
+    if np.array_equal(single, values, equal_nan=True):
+        return single
+    return values.astype(np.float64)
+
+
+def _stable_uuids(html):
+    """Replace the random UUIDs that Bokeh puts into standalone HTML with
+    ones that only depend on their order of appearance.
+
+    >>> a = "1b4e28ba-2fa1-11d2-883f-0016d3cca427 x 1b4e28ba-2fa1-11d2-883f-0016d3cca427"
+    >>> b = "6fa459ea-ee8a-3ca4-894e-db77e160355e x 6fa459ea-ee8a-3ca4-894e-db77e160355e"
+    >>> _stable_uuids(a) == _stable_uuids(b)
+    True
+    """
+    mapping = {}
+
+    def replace(match):
+        if match.group(0) not in mapping:
+            mapping[match.group(0)] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"epic-capybara/{len(mapping)}"))
+        return mapping[match.group(0)]
+
+    return _UUID_RE.sub(replace, html)
+
+
+@contextmanager
+def _deterministic_ids():
+    """Restart Bokeh's model ID counter for the duration of the block.
+
+    Model IDs then only depend on the document being built, and not on what
+    was built before it in the same process, which keeps the output
+    reproducible regardless of how documents are distributed over workers.
+
+    This relies on Bokeh internals, present in the supported Bokeh versions
+    (see pyproject.toml). Without them, Bokeh's own IDs are kept and the
+    output is not reproducible.
+    """
+    serialization = bokeh_serialization
+    if (not hasattr(serialization, "_simple_id_lock")
+            or not isinstance(getattr(serialization, "_simple_id", None), int)):
+        warnings.warn("Unsupported Bokeh version, report documents will not be reproducible")
+        yield
+        return
+
+    with serialization._simple_id_lock:
+        saved_id = serialization._simple_id
+        serialization._simple_id = 999
+    try:
+        yield
+    finally:
+        with serialization._simple_id_lock:
+            serialization._simple_id = saved_id
+
+
+def to_filename(branch_name):
+    return branch_name.replace("#", "__pound__").replace("/", "__underscore__")
+
+
+def _pvalue_marker(pvalue):
+    if pvalue > 0.99:
+        return " (*)"
+    elif pvalue > 0.95:
+        return " (**)"
+    elif pvalue > 0.67:
+        return " (***)"
+    else:
+        return " (****)"
+
+
+def option_label(collection_name, pvalue):
+    """
+    >>> option_label("MCParticles", 0.5)
+    'MCParticles (****)'
+    >>> option_label("MCParticles", None)
+    'MCParticles'
+    """
+    return collection_name + (_pvalue_marker(pvalue) if pvalue is not None else "")
+
+
+def make_options(summary):
+    """Return the options of the collection selector, most different first."""
+    def option_key(collection_name):
+        key = ""
+        pvalue = summary[collection_name]["pvalue"]
+        if pvalue is not None:
+            if pvalue > 0.99:
+                key += " 0.99"
+            elif pvalue > 0.95:
+                key += " 0.95"
+            elif pvalue > 0.67:
+                key += " 0.67"
+            else:
+                key += " 0.00"
+        key += collection_name.lstrip("_")
+        return key
+
+    options = [("", "")]
+    for collection_name in sorted(summary, key=option_key):
+        options.append((
+            to_filename(collection_name),
+            option_label(collection_name, summary[collection_name]["pvalue"]),
+        ))
+    return options
+
+
+def _mk_dropdown(value, options):
+    dropdown = Select(title=_SELECT_TITLE, value=value, options=options)
+    dropdown.js_on_change("value", CustomJS(code=_SELECT_CALLBACK_CODE))
+    return dropdown
+
+
+def _mk_figure(plot, band_exprs):
+    key = plot["key"]
+    fig = figure(x_axis_label=key, y_axis_label="Entries")
+    if plot["x_range"] < 1.:
+        fig.xaxis.formatter = PrintfTickFormatter(format="%.2g")
+
+    source_data = {"x": _compact_array(plot["x"])}
+    for file_ix, counts, _ in plot["series"]:
+        source_data[f"counts_{file_ix}"] = _compact_array(counts)
+    source = ColumnDataSource(source_data)
+
+    for file_ix, _, legend_label in plot["series"]:
+        color, line_width, line_dash, hatch_pattern = _VIS_PARAMS[file_ix]
+        field = f"counts_{file_ix}"
+        band_lo, band_hi = (
+            band_exprs.setdefault(
+                (field, sign),
+                CustomJSExpr(args={"field": field, "sign": sign}, code=_ERROR_BAND_EXPR_CODE),
+            )
+            for sign in (-1, 1)
+        )
+        step_r = fig.step(
+            x="x",
+            y=field,
+            mode="after",
+            source=source,
+            legend_label=legend_label,
+            line_color=color,
+            line_width=line_width,
+            line_dash=line_dash,
+        )
+        step_r.nonselection_glyph = step_r.glyph
+        varea_r = fig.varea_step(
+            x="x",
+            y1={"expr": band_lo},
+            y2={"expr": band_hi},
+            step_mode="after",
+            source=source,
+            legend_label=legend_label,
+            fill_color=color if hatch_pattern == " " else None,
+            fill_alpha=0.25,
+            hatch_color=color,
+            hatch_alpha=0.5,
+            hatch_pattern=hatch_pattern,
+        )
+        varea_r.nonselection_glyph = varea_r.glyph
+        fig.legend.background_fill_alpha = 0.5 # make legend more transparent
+
+    x_bounds = plot["x_bounds"]
+    y_bounds = plot["y_bounds"]
+    # Set y range for histograms
+    if np.all(np.isfinite(x_bounds)):
+        try:
+            fig.x_range = Range1d(
+                *x_bounds,
+                bounds=x_bounds)
+        except ValueError as e:
+            click.secho(str(e), fg="red", err=True)
+    else:
+        click.secho(f"overflow while calculating x bounds for \"{key}\"", fg="red", err=True)
+    if np.all(np.isfinite(y_bounds)):
+        try:
+            fig.y_range = Range1d(
+                *y_bounds,
+                bounds=y_bounds)
+        except ValueError as e:
+            click.secho(str(e), fg="red", err=True)
+    else:
+        click.secho(f"overflow while calculating y bounds for \"{key}\"", fg="red", err=True)
+
+    return fig
+
+
+def render_collection(task):
+    """Build and serialize the document of a single collection.
+
+    `task` is a tuple of (collection name, selector label, plots,
+    compression, compression level), where plots are plain dicts of
+    histogram data. Only plain data crosses process boundaries, the Bokeh
+    models are created here. Returns (filename, compressed document).
+    """
+    collection_name, label, plots, compression, compression_level = task
+    value = to_filename(collection_name)
+
+    with _deterministic_ids():
+        # Band expressions are shared by all figures of the collection
+        band_exprs = {}
+        figs = [_mk_figure(plot, band_exprs) for plot in plots]
+
+        # Embed only the currently selected option; the full list is stored once
+        # in index.html's JavaScript and restored client-side after each load.
+        # This avoids repeating a ~54 KB options list in every .json.gz file.
+        item = column(
+          _mk_dropdown(value, [("", ""), (value, label)]),
+          gridplot(figs, ncols=3, width=400, height=300),
+        )
+        data = json.dumps(json_item(item), separators=(',', ':')).encode()
+
+    return (
+        f"{value}{DOCUMENT_SUFFIXES[compression]}",
+        compress_document(data, compression, compression_level),
+    )
+
+
+def render_collections(tasks, jobs=None, mp_context=None):
+    """Render collection documents on `jobs` worker processes.
+
+    Yields (filename, compressed document) in the order of `tasks`,
+    regardless of the order in which workers finish them. `mp_context`
+    selects how the workers are started, e.g. "spawn" from multithreaded
+    processes, which are not safe to fork.
+    """
+    if jobs == 1:
+        yield from map(render_collection, tasks)
+        return
+    if mp_context is not None:
+        mp_context = multiprocessing.get_context(mp_context)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as executor:
+        yield from executor.map(render_collection, tasks)
+
+
+# BokehJS creates the comparator as new Function("x", "y", ..., code),
+# so the cell values are available as `x` and `y` in the snippet.
+_KS_SORTER_CODE = """
+    if (x === '' && y === '') return 0;
+    if (x === '') return 1;
+    if (y === '') return -1;
+    const nx = parseFloat(x), ny = parseFloat(y);
+    return nx < ny ? -1 : nx > ny ? 1 : 0;
+"""
+
+_AD_SORTER_CODE = """
+    if (x === '' && y === '') return 0;
+    if (x === '') return 1;
+    if (y === '') return -1;
+    if (x === 'n/a' && y === 'n/a') return 0;
+    if (x === 'n/a') return 1;
+    if (y === 'n/a') return -1;
+    const nx = parseFloat(x), ny = parseFloat(y);
+    return nx < ny ? -1 : nx > ny ? 1 : 0;
+"""
+
+
+def _mk_summary_table(summary):
+    rows = []
+    for collection_name in sorted(summary, key=lambda name: name.lstrip("_")):
+        entry = summary[collection_name]
+        pvalue = entry["pvalue"]
+        if pvalue is not None:
+            if pvalue > 0.99:
+                color = "#28a745"  # green
+            elif pvalue > 0.95:
+                color = "#ffc107"  # yellow
+            elif pvalue > 0.67:
+                color = "#fd7e14"  # orange
+            else:
+                color = "#dc3545"  # red
+            ks_str = (f"{entry['ks_pvalue']:.3f}"
+                      if entry["ks_pvalue"] is not None else "")
+            ad_str = (f"{entry['ad_pvalue']:.3f}"
+                      if entry["ad_pvalue"] is not None else "n/a")
+        else:
+            color = "transparent"
+            ks_str = ""
+            ad_str = ""
+        n_total = entry["n_plots"]
+        n_match = entry["n_match"]
+        n_diff = n_total - n_match
+        rows.append((collection_name, color, ks_str, ad_str, n_match, n_diff, n_total))
+
+    source = ColumnDataSource({
+        "collection": [r[0] for r in rows],
+        "filename":   [to_filename(r[0]) for r in rows],
+        "color":      [r[1] for r in rows],
+        "ks_pvalue":  [r[2] for r in rows],
+        "ad_pvalue":  [r[3] for r in rows],
+        "nmatch":     [r[4] for r in rows],
+        "ndiff":      [r[5] for r in rows],
+        "nplots":     [r[6] for r in rows],
+    })
+    square_style = (
+        'display:inline-block;width:0.9em;height:0.9em;'
+        'margin-right:6px;vertical-align:middle;'
+        'border:1px solid #999;background-color:<%= color %>;'
+    )
+    link_fmt = HTMLTemplateFormatter(
+        template=f'<span style="{square_style}"></span>'
+                 '<a href="#<%= filename %>"><%= value %></a>'
+    )
+    right_str = StringFormatter(text_align="right")
+    right_num = NumberFormatter(text_align="right")
+    columns = [
+        TableColumn(field="collection", title="Collection", formatter=link_fmt, width=500),
+        TableColumn(field="ks_pvalue", title="min KS p-value", formatter=right_str, width=120, sorter=CustomJSCompare(code=_KS_SORTER_CODE)),
+        TableColumn(field="ad_pvalue", title="min AD p-value", formatter=right_str, width=120, sorter=CustomJSCompare(code=_AD_SORTER_CODE)),
+        TableColumn(field="nmatch", title="# matching", formatter=right_num, width=80),
+        TableColumn(field="ndiff", title="# differing", formatter=right_num, width=80),
+        TableColumn(field="nplots", title="# plots", formatter=right_num, width=80),
+    ]
+    table = DataTable(
+        source=source,
+        columns=columns,
+        width=800,
+        sizing_mode="stretch_height",
+        index_position=None,
+        sortable=True,
+        selectable=True,
+    )
+    source.selected.js_on_change("indices", CustomJS(args={"source": source}, code="""
+      const idx = cb_obj.indices;
+      if (idx.length > 0) {
+        const filename = source.data["filename"][idx[0]];
+        window.location.hash = "#" + filename;
+        fetchAndReplaceBokehDocument(filename);
+      }
+    """))
+    return table
+
+
+_LOADER_CODE = """
+  window._bokehSelectOptions = all_options;
+
+  // Reports published with `cate --dedup' keep their data files in a
+  // shared blob store, the links file maps file names to those.
+  const links = fetch(links_filename)
+    .then((response) => response.ok ? response.json() : {})
+    .catch(() => ({}));
+
+  // Packed reports store all documents in one file, the index gives
+  // the byte range of each of them.
+  function fetchPackIndex() {
+    return (pack_index_filename === null)
+      ? Promise.resolve(null)
+      : links.then((links) => fetch(links[pack_index_filename] || pack_index_filename, {cache: 'no-cache'}))
+          .then((response) => response.ok ? response.json() : null)
+          .catch(() => null);
+  }
+  let packIndex = fetchPackIndex();
+
+  async function fetchDocument(filename) {
+    const resolved = await links;
+    const index = await packIndex;
+    if (index !== null && filename in index.entries) {
+      const [offset, length] = index.entries[filename];
+      const response = await fetch(resolved[index.pack] || index.pack, {
+        headers: {'Range': `bytes=${offset}-${offset + length - 1}`},
+        cache: 'no-cache',
+      });
+      if (!response.ok) {
+        throw new Error('Network response was not ok');
+      }
+      const buffer = await response.arrayBuffer();
+      if (response.status == 206) {
+        return buffer;
+      }
+      // The server ignored the Range header and sent the whole pack
+      return buffer.slice(offset, offset + length);
+    }
+    const response = await fetch(resolved[filename] || filename, {cache: 'no-cache'});
+    if (!response.ok) {
+      throw new Error('Network response was not ok');
+    }
+    return await response.arrayBuffer();
+  }
+
+  // Documents prefetched for the neighbours of the shown collection, so
+  // that stepping through the selector does not wait for the network.
+  const documentCache = new Map();
+
+  function loadDocument(location) {
+    if (!documentCache.has(location)) {
+      documentCache.set(location, fetchDocument(location + document_suffix)
+        .catch(function(error) {
+          documentCache.delete(location);
+          throw error;
+        }));
+    }
+    return documentCache.get(location);
+  }
+
+  function prefetchNeighbours(location) {
+    const values = all_options.map(([value]) => value).filter((value) => value != "");
+    const ix = values.indexOf(location);
+    if (ix < 0) {
+      return;
+    }
+    for (const neighbour of [values[ix + 1], values[ix - 1]]) {
+      if (neighbour !== undefined) {
+        loadDocument(neighbour).catch(() => {});
+      }
+    }
+  }
+
+  function sameBytes(a, b) {
+    if (a.byteLength != b.byteLength) {
+      return false;
+    }
+    const bytesA = new Uint8Array(a);
+    const bytesB = new Uint8Array(b);
+    return bytesA.every((value, ix) => value == bytesB[ix]);
+  }
+
+  let zstdDecoder = null;
+
+  async function decompressDocument(buffer) {
+    if (new Uint8Array(buffer, 0, 1)[0] == 0x7b) {
+      // Starts with '{', the server already decoded the document
+      // (`bara --serve' sends it with Content-Encoding: gzip)
+      return JSON.parse(new TextDecoder().decode(buffer));
+    }
+    if (compression == 'zstd') {
+      if (zstdDecoder === null) {
+        zstdDecoder = import(zstd_decoder_url);
+      }
+      const fzstd = await zstdDecoder;
+      return JSON.parse(new TextDecoder().decode(fzstd.decompress(new Uint8Array(buffer))));
+    }
+    const ds = new DecompressionStream('gzip');
+    const decompressedStream = new Blob([buffer]).stream().pipeThrough(ds);
+    const decompressedResponse = new Response(decompressedStream);
+    return await decompressedResponse.json();
+  }
+
+  async function replaceBokehDocument(location, buffer) {
+    const item = await decompressDocument(buffer);
+
+    Bokeh.documents[0].replace_with_json(item.doc);
+
+    // Restore the full options list to the newly loaded Select widget.
+    for (const [, model] of Bokeh.documents[0]._all_models) {
+      if (model.options instanceof Array) {
+        model.options = window._bokehSelectOptions;
+        model.value = location;
+        break;
+      }
+    }
+  }
+
+  function fetchAndReplaceBokehDocument(location) {
+    // The report can be rewritten while it is open, e.g. refined by `bara
+    // --progressive --serve'. A prefetched document is shown right away,
+    // and replaced if it changed since; fetches revalidate the browser
+    // cache, which answers unchanged documents without downloading them.
+    const prefetched = documentCache.get(location);
+    documentCache.delete(location);
+    packIndex = fetchPackIndex();
+    const fetched = fetchDocument(location + document_suffix);
+    (async function() {
+      const shown = (prefetched === undefined) ? null : await prefetched.catch(() => null);
+      if (shown !== null) {
+        await replaceBokehDocument(location, shown);
+      }
+      const buffer = await fetched;
+      if (shown === null || (!sameBytes(shown, buffer) && window.current_location == location)) {
+        await replaceBokehDocument(location, buffer);
+      }
+      prefetchNeighbours(location);
+    })().catch(function(error) {
+      console.error('Fetch or decompression failed:', error);
+    });
+  }
+
+  window.onhashchange = function() {
+    var location = window.location.hash.replace(/^#/, "");
+    if (location == "") {
+      // No hash: return to the index page. Since there is no index.json.gz,
+      // just reload the page to get a fresh index.html.
+      if (typeof window.current_location !== 'undefined') {
+        window.location.reload();
+      }
+      return;
+    }
+    if ((typeof current_location === 'undefined') || (current_location != location)) {
+      fetchAndReplaceBokehDocument(location);
+      window.current_location = location;
+    }
+  }
+  window.onhashchange();
+"""
+
+
+def write_index(output_dir, summary, pack=False, compression="gzip", note=None):
+    """Write index.html with the collection selector and the summary table.
+
+    `summary` maps collection names to dicts with the number of plots
+    ("n_plots"), the number of matching plots ("n_match") and the minimal
+    p-values ("pvalue", "ks_pvalue", "ad_pvalue", None if not compared).
+    A `note`, e.g. that the report is a preview, is shown above the table.
+    """
+    options = make_options(summary)
+    with _deterministic_ids():
+        doc = Document()
+        children = [_mk_dropdown("", options)]
+        if note is not None:
+            children.append(Div(text=f"<b>{escape_html(note)}</b>"))
+        children.append(_mk_summary_table(summary))
+        doc.add_root(column(*children, sizing_mode="stretch_height"))
+        doc.js_on_event(DocumentReady, CustomJS(args={
+            "all_options": options,
+            "links_filename": LINKS_FILENAME,
+            "pack_index_filename": PACK_INDEX_FILENAME if pack else None,
+            "document_suffix": DOCUMENT_SUFFIXES[compression],
+            "compression": compression,
+            "zstd_decoder_url": _ZSTD_DECODER_URL,
+        }, code=_LOADER_CODE))
+        html = file_html(doc, resources=CDN, title="ePIC capybara report")
+    atomic_write(f"{output_dir}/index.html", _stable_uuids(html).encode())
+
+
+def write_trend(path, artifact, key, rows):
+    """Write an HTML page with the history of a leaf.
+
+    `rows` are rows of epic_capybara.trend.TrendStore.history(), oldest
+    first. The mean with a band of one standard deviation and the p-values
+    are plotted against the position of the commit in the history.
+    """
+    source = ColumnDataSource({
+        "ix": np.arange(len(rows)),
+        "commit": [row["commit_sha"] for row in rows],
+        "entries": [row["entries"] for row in rows],
+        **{
+            column_name: np.array([np.nan if row[column_name] is None else row[column_name] for row in rows], dtype=np.float64)
+            for column_name in ["mean", "std", "pvalue", "ks_pvalue", "ad_pvalue"]
+        },
+    })
+    source.data["lower"] = source.data["mean"] - source.data["std"]
+    source.data["upper"] = source.data["mean"] + source.data["std"]
+    tooltips = [
+        ("commit", "@commit"),
+        ("entries", "@entries"),
+        ("mean", "@mean"),
+        ("std", "@std"),
+        ("p-value", "@pvalue"),
+    ]
+
+    with _deterministic_ids():
+        mean_fig = figure(title=f"{artifact}: {key}", x_axis_label="Commit", y_axis_label=key, width=900, height=350)
+        mean_fig.varea(x="ix", y1="lower", y2="upper", source=source, fill_color="green", fill_alpha=0.25, legend_label="mean ± std")
+        mean_fig.line(x="ix", y="mean", source=source, line_color="green", legend_label="mean ± std")
+        mean_fig.scatter(x="ix", y="mean", source=source, color="green", size=4)
+        mean_fig.add_tools(HoverTool(tooltips=tooltips))
+
+        pvalue_fig = figure(x_axis_label="Commit", y_axis_label="p-value", x_range=mean_fig.x_range, y_range=Range1d(-0.05, 1.05), width=900, height=250)
+        for column_name, color, legend_label in [("ks_pvalue", "red", "KS"), ("ad_pvalue", "blue", "AD")]:
+            pvalue_fig.scatter(x="ix", y=column_name, source=source, color=color, size=5, legend_label=legend_label)
+        pvalue_fig.add_tools(HoverTool(tooltips=tooltips))
+
+        doc = Document()
+        doc.add_root(column(mean_fig, pvalue_fig))
+        html = file_html(doc, resources=CDN, title=f"ePIC capybara trend: {key}")
+    atomic_write(path, _stable_uuids(html).encode())
@@ -0,0 +1,156 @@
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+
+
+# Packed report layout: all collection documents concatenated in a single
+# file, plus a small JSON index of their offsets and lengths.
+PACK_FILENAME = "capybara-reports.pack"
+PACK_INDEX_FILENAME = "capybara-reports.pack.json"
+
+DOCUMENT_SUFFIXES = {
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
+
+
+def compress_document(data, compression="gzip", level=None):
+    """Compress a serialized report document.
+
+    gzip output uses a fixed timestamp, so that identical documents give
+    identical files.
+
+    >>> gzip.decompress(compress_document(b"{}")) == b"{}"
+    True
+    >>> compress_document(b"{}", level=1) == compress_document(b"{}", level=1)
+    True
+    """
+    if compression == "gzip":
+        # gzip.compress() only takes mtime since Python 3.8
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9 if level is None else level, mtime=0) as fp:
+            fp.write(data)
+        return buf.getvalue()
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the zstandard package (pip install epic-capybara[zstd])")
+        return zstandard.ZstdCompressor(level=19 if level is None else level).compress(data)
+    raise ValueError(f"Unknown compression \"{compression}\"")
+
+
+def atomic_write(path, data):
+    """Write bytes to a file so that readers never observe a partial file."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp_path, path)
+
+
+class DirectoryWriter:
+    """Store every report document as a separate file."""
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+
+    def write(self, filename, data):
+        atomic_write(self.output_dir / filename, data)
+
+    def can_keep(self, filename):
+        return (self.output_dir / filename).exists()
+
+    def keep(self, filename):
+        """Retain a document written by a previous run."""
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class PackWriter:
+    """Store report documents in one pack file with an offset index.
+
+    Each document is appended to the pack as is, so a client can fetch it
+    with an HTTP Range request for `bytes=offset-(offset + length - 1)`.
+    The index has the form
+
+        {"pack": "capybara-reports.pack", "entries": {"<filename>": [offset, length], ...}}
+
+    If writing fails, abort() discards the new pack, leaving the previous
+    one in place.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     writer = PackWriter(tmp)
+    ...     writer.write("b.json.gz", b"BB")
+    ...     writer.write("a.json.gz", b"A")
+    ...     writer.close()
+    ...     writer = PackWriter(tmp)
+    ...     writer.write("a.json.gz", b"partial")
+    ...     writer.abort()
+    ...     read_pack(tmp, "a.json.gz"), read_pack(tmp, "b.json.gz"), sorted(os.listdir(tmp))
+    (b'A', b'BB', ['capybara-reports.pack', 'capybara-reports.pack.json'])
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.entries = {}
+        self._tmp_path = self.output_dir / f".{PACK_FILENAME}.{os.getpid()}.tmp"
+        self._fp = open(self._tmp_path, "wb")
+        try:
+            with open(self.output_dir / PACK_INDEX_FILENAME) as fp:
+                self._previous = json.load(fp)
+        except (OSError, ValueError):
+            self._previous = {"pack": PACK_FILENAME, "entries": {}}
+
+    def write(self, filename, data):
+        self.entries[filename] = [self._fp.tell(), len(data)]
+        self._fp.write(data)
+
+    def can_keep(self, filename):
+        return (
+            filename in self._previous["entries"]
+            and (self.output_dir / self._previous["pack"]).exists()
+        )
+
+    def keep(self, filename):
+        """Copy a document from the pack written by a previous run."""
+        offset, length = self._previous["entries"][filename]
+        with open(self.output_dir / self._previous["pack"], "rb") as fp:
+            fp.seek(offset)
+            self.write(filename, fp.read(length))
+
+    def close(self):
+        self._fp.close()
+        os.replace(self._tmp_path, self.output_dir / PACK_FILENAME)
+        index = {
+            "pack": PACK_FILENAME,
+            "entries": dict(sorted(self.entries.items())),
+        }
+        atomic_write(
+            self.output_dir / PACK_INDEX_FILENAME,
+            json.dumps(index, separators=(',', ':')).encode(),
+        )
+
+    def abort(self):
+        """Discard the documents written so far."""
+        self._fp.close()
+        os.remove(self._tmp_path)
+
+
+def read_pack(output_dir, filename):
+    """Return a single document stored in a pack."""
+    output_dir = Path(output_dir)
+    with open(output_dir / PACK_INDEX_FILENAME) as fp:
+        index = json.load(fp)
+    offset, length = index["entries"][filename]
+    with open(output_dir / index["pack"], "rb") as fp:
+        fp.seek(offset)
+        return fp.read(length)
@@ -0,0 +1,232 @@
+import email.utils
+import os
+import re
+import threading
+from datetime import timezone
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from .filesystem import hashfileobj
+from .report import DOCUMENT_SUFFIXES
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 24535
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """Return the (start, stop) span requested by a `Range` header.
+
+    Returns None if the header is to be ignored, i.e. the whole file is to
+    be sent, and raises ValueError if the range can not be satisfied.
+    Multiple ranges are not supported.
+
+    >>> parse_range("bytes=0-9", 100), parse_range("bytes=90-", 100), parse_range("bytes=-5", 100)
+    ((0, 10), (90, 100), (95, 100))
+    >>> parse_range("bytes=90-200", 100)
+    (90, 100)
+    >>> parse_range("bytes=0-1,4-5", 100) is None, parse_range("bytes=5-1", 100) is None
+    (True, True)
+    >>> parse_range("bytes=100-", 100)
+    Traceback (most recent call last):
+    ...
+    ValueError: unsatisfiable range bytes=100- for 100 bytes
+    """
+    match = _RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "":
+        if last == "":
+            return None
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(f"unsatisfiable range {header} for {size} bytes")
+        return max(size - length, 0), size
+    start = int(first)
+    if last != "" and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(f"unsatisfiable range {header} for {size} bytes")
+    stop = size if last == "" else min(int(last) + 1, size)
+    return start, stop
+
+
+def _accepts_gzip(accept_encoding):
+    """
+    >>> _accepts_gzip("gzip, deflate, br"), _accepts_gzip("br;q=1.0, gzip;q=0"), _accepts_gzip("")
+    (True, False, False)
+    """
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class _LimitedReader:
+    """Read at most `length` bytes from a file object."""
+
+    def __init__(self, fp, length):
+        self.fp = fp
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+class ReportRequestHandler(SimpleHTTPRequestHandler):
+    """Serve a report directory.
+
+    On top of SimpleHTTPRequestHandler this
+
+    - sends gzip-compressed documents with "Content-Encoding: gzip", so that
+      browsers decompress them natively,
+    - sends strong ETags together with "Cache-Control: no-cache" and answers
+      conditional requests, so that revisited documents are revalidated with
+      a 304 instead of being downloaded again, while regenerated reports are
+      still picked up,
+    - answers single-range requests, used to fetch documents from packs.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # path -> ((st_dev, st_ino, st_size, st_mtime_ns), digest)
+    _digests = {}
+    _digests_lock = threading.Lock()
+
+    def _digest(self, path, fp, st):
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._digests_lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # hash the opened file, report files are replaced atomically
+        digest = hashfileobj(fp)
+        fp.seek(0)
+        with self._digests_lock:
+            self._digests[path] = (key, digest)
+        return digest
+
+    def _not_modified(self, etag, st):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return int(st.st_mtime) <= since.timestamp()
+        return False
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index_path = os.path.join(path, "index.html")
+            if not self.path.split("?", 1)[0].endswith("/") or not os.path.isfile(index_path):
+                # redirect or directory listing
+                return super().send_head()
+            path = index_path
+        try:
+            fp = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        try:
+            st = os.fstat(fp.fileno())
+            digest = self._digest(path, fp, st)
+            content_type = self.guess_type(path)
+            headers = [
+                ("Cache-Control", "no-cache"),
+                ("Last-Modified", self.date_time_string(st.st_mtime)),
+                ("Accept-Ranges", "bytes"),
+            ]
+            if path.endswith(DOCUMENT_SUFFIXES["gzip"]):
+                headers.append(("Vary", "Accept-Encoding"))
+                if _accepts_gzip(self.headers.get("Accept-Encoding", "")):
+                    content_type = "application/json"
+                    headers.append(("Content-Encoding", "gzip"))
+                    # a different representation needs a different tag
+                    digest += "-gzip"
+            etag = f'"{digest}"'
+            headers.append(("ETag", etag))
+
+            if self._not_modified(etag, st):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                for header in headers:
+                    self.send_header(*header)
+                self.end_headers()
+                fp.close()
+                return None
+
+            span = None
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header is not None and (if_range is None or if_range.strip() == etag):
+                try:
+                    span = parse_range(range_header, st.st_size)
+                except ValueError:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{st.st_size}")
+                    self.send_header("Content-Length", "0")
+                    for header in headers:
+                        self.send_header(*header)
+                    self.end_headers()
+                    fp.close()
+                    return None
+
+            if span is None:
+                start, stop = 0, st.st_size
+                self.send_response(HTTPStatus.OK)
+            else:
+                start, stop = span
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{st.st_size}")
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(stop - start))
+            for header in headers:
+                self.send_header(*header)
+            self.end_headers()
+            fp.seek(start)
+            return _LimitedReader(fp, stop - start)
+        except Exception:
+            fp.close()
+            raise
+
+
+def serve(directory, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Serve a report directory until interrupted.
+
+    Every connection is handled in its own thread, so that parallel fetches
+    from the browser do not queue up behind each other.
+    """
+    handler = partial(ReportRequestHandler, directory=os.fspath(directory))
+    with ThreadingHTTPServer((host, port), handler) as httpd:
+        print(f"Serving report at http://{host}:{port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
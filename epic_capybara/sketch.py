@@ -0,0 +1,231 @@
+import numpy as np
+from scipy.stats import kstwo
+
+
+DEFAULT_SKETCH_SIZE = 8192
+
+
+class QuantileSketch:
+    """A mergeable quantile sketch built from KLL-style compactors.
+
+    Level h holds sorted-on-demand values of weight 2**h. Once a level holds
+    more than `k` values, they are sorted and every other one, starting at a
+    random offset, is promoted to the next level with twice the weight. A
+    compaction at level h changes the rank of any value by at most 2**h, the
+    sum of those is kept in `max_error`, so that
+
+        |sketch.cdf(x) - exact cdf(x)| <= sketch.rank_error
+
+    holds for every x, not just with high probability. The bound grows as
+    about n * log2(n / k) / k, the memory as k * log2(n / k) values.
+
+    Sketches are updated chunk by chunk and can be merged, the error bounds
+    of merged sketches add up. NaN values are ignored.
+
+    >>> rng = np.random.default_rng(0)
+    >>> values = rng.normal(size=100000)
+    >>> sketch = QuantileSketch(k=1024)
+    >>> for chunk in np.array_split(values, 10):
+    ...     _ = sketch.update(chunk)
+    >>> sketch.n, len(sketch.levels) < 10, sketch.rank_error < 0.02
+    (100000, True, True)
+    >>> bool(abs(sketch.cdf(0.5) - np.mean(values <= 0.5)) <= sketch.rank_error)
+    True
+    >>> merged = QuantileSketch(k=1024).update(values[:50000]).merge(QuantileSketch(k=1024).update(values[50000:]))
+    >>> bool(abs(merged.cdf(0.5) - np.mean(values <= 0.5)) <= merged.rank_error)
+    True
+    """
+
+    def __init__(self, k=DEFAULT_SKETCH_SIZE, seed=0):
+        self.k = k
+        self.levels = []
+        self.n = 0
+        self.max_error = 0
+        self._rng = np.random.default_rng(seed)
+        self._weighted = None
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    @property
+    def exact(self):
+        """Whether no values were compacted, the sketch then holds all of
+        them, in the order they were added."""
+        return self.max_error == 0
+
+    @property
+    def rank_error(self):
+        """Bound on the absolute error of cdf()."""
+        return self.max_error / self.n if self.n > 0 else 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        if not self.levels:
+            self.levels.append(np.empty(0))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compact()
+        return self
+
+    def merge(self, other):
+        """Add the values summarized by `other` to this sketch."""
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.n += other.n
+        self.max_error += other.max_error
+        self._compact()
+        return self
+
+    def _compact(self):
+        self._weighted = None
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.k:
+                level = np.sort(level)
+                # with an odd number of values, the smallest one stays
+                leftover = len(level) % 2
+                promoted = level[leftover + self._rng.integers(2)::2]
+                self.levels[h] = level[:leftover]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.max_error += 2**h
+            h += 1
+
+    def weighted_values(self):
+        """Return the values held by the sketch and the number of values
+        each stands for.
+
+        >>> QuantileSketch(k=2).update([3.0, 1.0, 2.0]).weighted_values()
+        (array([1., 3.]), array([1, 2]))
+        """
+        if not self.levels:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        return np.concatenate(self.levels), np.concatenate([
+            np.full(len(level), 2**h, dtype=np.int64) for h, level in enumerate(self.levels)
+        ])
+
+    def _values_ranks(self):
+        """Return the sorted distinct values and the weighted number of
+        values less than or equal to each."""
+        if self._weighted is None:
+            values, weights = self.weighted_values()
+            order = np.argsort(values, kind="stable")
+            values = values[order]
+            ranks = np.cumsum(weights[order])
+            # keep the last of equal values, which has the rank of all of them
+            last = np.append(values[1:] != values[:-1], True) if len(values) > 0 else np.empty(0, dtype=bool)
+            self._weighted = (values[last], ranks[last])
+        return self._weighted
+
+    def cdf(self, x):
+        """Return the estimated fraction of values less than or equal to `x`."""
+        values, ranks = self._values_ranks()
+        ix = np.searchsorted(values, x, side="right")
+        rank = np.where(ix > 0, ranks[np.maximum(ix - 1, 0)], 0) if len(values) > 0 else np.zeros_like(ix)
+        return rank / self.n if self.n > 0 else rank * 0.0
+
+
+def _support(a, b):
+    return np.union1d(a._values_ranks()[0], b._values_ranks()[0])
+
+
+def ks_statistic(a, b):
+    """Return the two-sample Kolmogorov-Smirnov distance of two sketches and
+    the bound on its error, a.rank_error + b.rank_error.
+
+    >>> a = QuantileSketch(k=16).update(np.arange(100))
+    >>> b = QuantileSketch(k=16).update(np.arange(100) + 10)
+    >>> d, bound = ks_statistic(a, b)
+    >>> bool(abs(d - 0.1) <= bound)
+    True
+    """
+    x = _support(a, b)
+    if len(x) == 0:
+        return 0.0, 0.0
+    d = float(np.max(np.abs(a.cdf(x) - b.cdf(x))))
+    return d, a.rank_error + b.rank_error
+
+
+def ks_pvalue(a, b):
+    """Return a conservative asymptotic KS p-value from two sketches.
+
+    The distance is reduced by its error bound before computing the p-value,
+    so identical distributions are not flagged due to sketch errors, while
+    differences smaller than the bound may be missed.
+
+    >>> a = QuantileSketch(k=16).update(np.arange(100))
+    >>> ks_pvalue(a, a)
+    1.0
+    """
+    d, bound = ks_statistic(a, b)
+    n = round(a.n * b.n / (a.n + b.n))
+    return float(kstwo.sf(max(d - bound, 0.0), n))
+
+
+def ad_statistic(a, b):
+    """Return the two-sample Anderson-Darling statistic of two sketches and a
+    lower bound on it.
+
+        A2 = n_a n_b / N * sum (F_a - F_b)^2 / (H (1 - H)) dH
+
+    where H is the pooled distribution. The lower bound reduces |F_a - F_b|
+    by a.rank_error + b.rank_error at every point. The weight 1 / (H (1 - H))
+    is taken from the sketches as they are, the bound does not cover its
+    error, which is largest in the far tails.
+    """
+    x = _support(a, b)
+    if len(x) == 0:
+        return 0.0, 0.0
+    total = a.n + b.n
+    cdf_a = a.cdf(x)
+    cdf_b = b.cdf(x)
+    pooled = (a.n * cdf_a + b.n * cdf_b) / total
+    d_pooled = np.diff(pooled, prepend=0.0)
+    inside = (pooled > 0) & (pooled < 1)
+    weight = d_pooled[inside] / (pooled[inside] * (1 - pooled[inside]))
+    diff = np.abs(cdf_a - cdf_b)[inside]
+    scale = a.n * b.n / total
+    bound = a.rank_error + b.rank_error
+    return (
+        float(scale * np.sum(diff**2 * weight)),
+        float(scale * np.sum(np.maximum(diff - bound, 0.0)**2 * weight)),
+    )
+
+
+def _ad_cdf(z):
+    """Asymptotic distribution of the Anderson-Darling statistic (Marsaglia &
+    Marsaglia, 2004), the same for the one- and two-sample statistics."""
+    if z <= 0:
+        return 0.0
+    if z < 2:
+        return (np.exp(-1.2337141 / z) / np.sqrt(z)
+                * (2.00012 + (0.247105 - (0.0649821 - (0.0347962 - (0.011672 - 0.00168691 * z) * z) * z) * z) * z))
+    return np.exp(-np.exp(1.0776 - (2.30695 - (0.43424 - (0.082433 - (0.008056 - 0.0003146 * z) * z) * z) * z) * z))
+
+
+def ad_pvalue(a, b):
+    """Return an approximate asymptotic Anderson-Darling p-value from two
+    sketches, computed from the lower bound of the statistic.
+
+    Unlike ks_pvalue(), this is not conservative: the lower bound does not
+    cover the error of the 1 / (H (1 - H)) weight, see ad_statistic(), so
+    sketch errors in the tails can make the p-value smaller than the exact
+    one.
+
+    >>> rng = np.random.default_rng(0)
+    >>> a = QuantileSketch(k=256).update(rng.normal(size=20000))
+    >>> b = QuantileSketch(k=256).update(rng.normal(size=20000))
+    >>> c = QuantileSketch(k=256).update(rng.normal(0.2, size=20000))
+    >>> ad_pvalue(a, b) > 0.01, ad_pvalue(a, c) < 0.01
+    (True, True)
+    """
+    _, lower = ad_statistic(a, b)
+    return float(min(1.0, max(0.0, 1.0 - _ad_cdf(lower))))
@@ -0,0 +1,172 @@
+import zlib
+
+import awkward as ak
+import numpy as np
+import uproot
+
+
+# collection name -> {leaf path: dtype}
+DEFAULT_COLLECTIONS = {
+    "MCParticles": {
+        "PDG": "int32",
+        "generatorStatus": "int32",
+        "mass": "float64",
+        "momentum.x": "float32",
+        "momentum.y": "float32",
+        "momentum.z": "float32",
+    },
+    "ReconstructedParticles": {
+        "charge": "float32",
+        "energy": "float32",
+        "momentum.x": "float32",
+        "momentum.y": "float32",
+        "momentum.z": "float32",
+    },
+    "EcalBarrelClusters": {
+        "energy": "float32",
+        "nHits": "uint32",
+        "position.x": "float32",
+        "position.y": "float32",
+        "position.z": "float32",
+    },
+}
+
+
+def _rng(seed, name):
+    # Every collection and leaf draws from its own stream, so that changing
+    # one of them does not change any other
+    return np.random.default_rng([seed, zlib.crc32(name.encode())])
+
+
+def generate_events(n_events=1000, collections=None, multiplicity=5, differences=None, shuffle=False, seed=0):
+    """Return synthetic events in the EDM4hep layout used by `bara`.
+
+    The result maps collection names to jagged arrays of records, including
+    an "EventHeader" collection with a single "eventNumber" per event.
+    `collections` maps collection names to {leaf path: dtype} (defaults to
+    DEFAULT_COLLECTIONS). The number of objects per event is Poisson
+    distributed with a mean of `multiplicity`. Integer leaves are uniform
+    in [-20, 20] (in [0, 40] for unsigned ones), floating point leaves are
+    standard normal.
+
+    `differences` maps normalized keys, e.g. "MCParticles.momentum.x", to
+    a shift added to the values of that leaf. Files generated with the same
+    seed are otherwise identical. With `shuffle` the events are stored in a
+    random order, as in files merged from several jobs.
+
+    >>> events = generate_events(n_events=3, multiplicity=2)
+    >>> sorted(events)
+    ['EcalBarrelClusters', 'EventHeader', 'MCParticles', 'ReconstructedParticles']
+    >>> events["EventHeader"]["eventNumber"].tolist()
+    [[0], [1], [2]]
+    >>> shifted = generate_events(n_events=3, multiplicity=2, differences={"MCParticles.mass": 1.0})
+    >>> bool(ak.all(abs(shifted["MCParticles"]["mass"] - events["MCParticles"]["mass"] - 1.0) < 1e-9))
+    True
+    >>> bool(ak.all(shifted["MCParticles"]["PDG"] == events["MCParticles"]["PDG"]))
+    True
+    """
+    if collections is None:
+        collections = DEFAULT_COLLECTIONS
+    differences = differences or {}
+
+    order = np.arange(n_events)
+    if shuffle:
+        order = _rng(seed, "shuffle").permutation(n_events)
+
+    events = {
+        "EventHeader": ak.zip({
+            "eventNumber": ak.unflatten(order.astype(np.int32), np.ones(n_events, dtype=np.int64)),
+        }),
+    }
+    for collection_name, leaves in collections.items():
+        counts = _rng(seed, collection_name).poisson(multiplicity, n_events)
+        total = int(counts.sum())
+        fields = {}
+        for leaf, dtype in leaves.items():
+            key = f"{collection_name}.{leaf}"
+            rng = _rng(seed, key)
+            dtype = np.dtype(dtype)
+            if dtype.kind == "u":
+                values = rng.integers(0, 41, total)
+            elif dtype.kind == "i":
+                values = rng.integers(-20, 21, total)
+            else:
+                values = rng.normal(0., 1., total)
+            shift = differences.get(key, 0)
+            if shift:
+                values = values + (np.round(shift) if dtype.kind in "iu" else shift)
+            values = ak.unflatten(values.astype(dtype), counts)
+            fields[leaf] = values[order] if shuffle else values
+        events[collection_name] = ak.zip(fields)
+    return events
+
+
+def _nest(array):
+    """Turn dotted record fields, e.g. "momentum.x", into nested records."""
+    groups = {}
+    for field in ak.fields(array):
+        head, _, rest = field.partition(".")
+        groups.setdefault(head, {})[rest] = array[field]
+    contents = {}
+    for head, group in groups.items():
+        if "" in group:
+            contents[head] = group[""]
+        else:
+            contents[head] = _nest(ak.zip(group))
+    return ak.zip(contents)
+
+
+def write_events(path, events, format="ttree", cluster_size=None):
+    """Write events from generate_events() to an "events" TTree or RNTuple.
+
+    TTree branches are keyed as in PODIO files
+    ("MCParticles/MCParticles.momentum.x"), RNTuple fields are nested records
+    keyed as in RNTuple PODIO files ("MCParticles.momentum.x"). Unlike in
+    PODIO files, the TTree branches are flat, with "/" in their names, and
+    the number of objects per event is stored in a leaf of its own
+    ("MCParticles/MCParticles"), which `bara` skips as a non-array branch,
+    rather than in a collection branch holding the others.
+    With `cluster_size`, events are written in chunks of that many entries,
+    each becoming an RNTuple cluster or a TTree basket.
+
+    >>> import tempfile, os
+    >>> events = generate_events(n_events=3, multiplicity=2)
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     for format in ["ttree", "rntuple"]:
+    ...         write_events(os.path.join(tmp, f"{format}.root"), events, format=format)
+    ...         with uproot.open(os.path.join(tmp, f"{format}.root")) as f:
+    ...             print([key for key in f["events"].keys(recursive=True) if key.startswith("MCParticles") and key.endswith("x")])
+    ...     write_events(os.path.join(tmp, "clusters.root"), events, format="rntuple", cluster_size=2)
+    ...     with uproot.open(os.path.join(tmp, "clusters.root")) as f:
+    ...         print([cluster.num_entries for cluster in f["events"].cluster_summaries])
+    ['MCParticles/MCParticles.momentum.x']
+    ['MCParticles.momentum.x']
+    [2, 1]
+    """
+    if format not in ["ttree", "rntuple"]:
+        raise ValueError(f"Unknown format \"{format}\"")
+    num_entries = len(next(iter(events.values())))
+    if cluster_size is None:
+        cluster_size = max(num_entries, 1)
+    chunks = [
+        {name: array[start:start + cluster_size] for name, array in events.items()}
+        for start in range(0, max(num_entries, 1), cluster_size)
+    ]
+    with uproot.recreate(path) as f:
+        if format == "ttree":
+            f.mktree(
+                "events",
+                {name: array.type for name, array in events.items()},
+                field_name=lambda outer, inner: f"{outer}/{outer}.{inner}",
+                counter_name=lambda counted: f"{counted}/{counted}",
+            )
+            for chunk in chunks:
+                f["events"].extend(chunk)
+        else:
+            ntuple = None
+            for chunk in chunks:
+                data = ak.Array({name: _nest(array) for name, array in chunk.items()})
+                if ntuple is None:
+                    ntuple = f.mkrntuple("events", data)
+                else:
+                    ntuple.extend(data)
@@ -0,0 +1,151 @@
+import sqlite3
+import time
+
+import awkward as ak
+import numpy as np
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leaves (
+    commit_sha TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    key TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    entries INTEGER NOT NULL,
+    mean REAL,
+    std REAL,
+    min REAL,
+    max REAL,
+    pvalue REAL,
+    ks_pvalue REAL,
+    ad_pvalue REAL,
+    edges BLOB,
+    counts BLOB,
+    PRIMARY KEY (commit_sha, artifact, key)
+);
+CREATE INDEX IF NOT EXISTS leaves_history ON leaves (artifact, key, recorded_at);
+CREATE INDEX IF NOT EXISTS leaves_key ON leaves (key);
+"""
+
+_COLUMNS = [
+    "commit_sha", "artifact", "key", "recorded_at",
+    "entries", "mean", "std", "min", "max",
+    "pvalue", "ks_pvalue", "ad_pvalue",
+    "edges", "counts",
+]
+
+
+def leaf_statistics(values):
+    """Return the number of entries and the mean, standard deviation, minimum
+    and maximum of the finite values of a leaf.
+
+    >>> leaf_statistics(ak.Array([[1.0, 3.0], [], [float("nan")]]))
+    {'entries': 3, 'mean': 2.0, 'std': 1.0, 'min': 1.0, 'max': 3.0}
+    >>> leaf_statistics(ak.Array([[], []]))
+    {'entries': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+    """
+    flat = ak.to_numpy(ak.flatten(values, axis=None))
+    finite = flat[np.isfinite(flat)]
+    statistics = {"entries": len(flat)}
+    for name, fn in [("mean", np.mean), ("std", np.std), ("min", np.min), ("max", np.max)]:
+        statistics[name] = float(fn(finite)) if len(finite) > 0 else None
+    return statistics
+
+
+class TrendStore:
+    """Per-leaf history of comparisons in a SQLite database.
+
+    Every row holds the histogram, summary statistics and p-values of one
+    leaf of one artifact at one commit. Recording the same commit, artifact
+    and leaf again replaces the row.
+
+    >>> store = TrendStore(":memory:")
+    >>> recorder = store.recorder("abc123", "rec.edm4eic.root", recorded_at=1.0)
+    >>> recorder.add("MCParticles.PDG", leaf_statistics(ak.Array([[11, 22]])), {"pvalue": 0.5, "ks_pvalue": 0.5, "ad_pvalue": None}, [10.0, 20.0, 30.0], [1, 1])
+    >>> recorder.flush()
+    >>> [(row["commit_sha"], row["mean"], row["counts"].tolist()) for row in store.history("rec.edm4eic.root", "MCParticles.PDG")]
+    [('abc123', 16.5, [1, 1])]
+    >>> store.keys("rec.edm4eic.root")
+    ['MCParticles.PDG']
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def recorder(self, commit_sha, artifact, recorded_at=None):
+        return TrendRecorder(self, commit_sha, artifact, time.time() if recorded_at is None else recorded_at)
+
+    def insert(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO leaves ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [[row[column] for column in _COLUMNS] for row in rows],
+            )
+
+    def artifacts(self):
+        return [artifact for artifact, in self.connection.execute(
+            "SELECT DISTINCT artifact FROM leaves ORDER BY artifact"
+        )]
+
+    def keys(self, artifact=None):
+        if artifact is None:
+            cursor = self.connection.execute("SELECT DISTINCT key FROM leaves ORDER BY key")
+        else:
+            cursor = self.connection.execute(
+                "SELECT DISTINCT key FROM leaves WHERE artifact = ? ORDER BY key", (artifact,)
+            )
+        return [key for key, in cursor]
+
+    def history(self, artifact, key, limit=None):
+        """Return the rows of a leaf, oldest first, the last `limit` of them
+        if given. Histograms are decoded to arrays."""
+        query = "SELECT * FROM leaves WHERE artifact = ? AND key = ? ORDER BY recorded_at DESC"
+        params = [artifact, key]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor = self.connection.execute(query, params)
+        names = [description[0] for description in cursor.description]
+        rows = []
+        for values in cursor:
+            row = dict(zip(names, values))
+            row["edges"] = None if row["edges"] is None else np.frombuffer(row["edges"], dtype=np.float64)
+            row["counts"] = None if row["counts"] is None else np.frombuffer(row["counts"], dtype=np.int64)
+            rows.append(row)
+        return rows[::-1]
+
+
+class TrendRecorder:
+    """Collect the leaves of one comparison and write them to a TrendStore
+    in one transaction."""
+
+    def __init__(self, store, commit_sha, artifact, recorded_at):
+        self.store = store
+        self.commit_sha = commit_sha
+        self.artifact = artifact
+        self.recorded_at = recorded_at
+        self.rows = []
+
+    def add(self, key, statistics, result, edges, counts):
+        """Record a leaf: its statistics (see leaf_statistics), the p-values
+        from its comparison (see bara's _compare_leaf) and its histogram."""
+        self.rows.append({
+            "commit_sha": self.commit_sha,
+            "artifact": self.artifact,
+            "key": key,
+            "recorded_at": self.recorded_at,
+            **statistics,
+            "pvalue": result["pvalue"],
+            "ks_pvalue": result["ks_pvalue"],
+            "ad_pvalue": result["ad_pvalue"],
+            "edges": None if edges is None else np.asarray(edges, dtype=np.float64).tobytes(),
+            "counts": None if counts is None else np.asarray(counts, dtype=np.int64).tobytes(),
+        })
+
+    def flush(self):
+        self.store.insert(self.rows)
+        self.rows = []
@@ -5,7 +5,7 @@ from itertools import chain, cycle, dropwhile, starmap, tee
 
 def get_cache_dir():
     if "XDG_CACHE_HOME" in os.environ:
-        return os.environ["XDG_CACHE_HOME"] / "epic-capybara"
+        return Path(os.environ["XDG_CACHE_HOME"]) / "epic-capybara"
     elif "HOME" in os.environ:
         return Path(os.environ["HOME"]) / ".cache" / "epic-capybara"
     elif "TMPDIR" in os.environ:
@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from epic_capybara.cli.bara import bara
+from epic_capybara.incremental import MANIFEST_FILENAME
+from epic_capybara.profiling import Profiler, activate
+from epic_capybara.synthetic import generate_events, write_events
+
+
+def test_bara_synthetic(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, generate_events(n_events=200))
+    write_events(
+        candidate,
+        generate_events(n_events=200, differences={"MCParticles.momentum.x": 1.0}, shuffle=True),
+        format="rntuple",
+    )
+
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(bara, [str(reference), str(candidate), "--incremental", "-j", "1"])
+    assert result.exit_code == 0, result.output
+
+    with open(tmp_path / "capybara-reports" / MANIFEST_FILENAME) as fp:
+        collections = json.load(fp)["collections"]
+    # TTree keys such as "MCParticles/MCParticles.momentum.x" are matched to
+    # RNTuple ones, and the counters of the TTree are not compared
+    assert sorted(collections) == ["EcalBarrelClusters", "EventHeader", "MCParticles", "ReconstructedParticles"]
+    summary = {name: entry["summary"] for name, entry in collections.items() if entry["summary"] is not None}
+    assert summary["MCParticles"]["n_plots"] == 6
+    assert summary["MCParticles"]["pvalue"] < 0.01
+    assert summary["MCParticles"]["n_match"] == summary["MCParticles"]["n_plots"] - 1
+    for name in ["EcalBarrelClusters", "EventHeader", "ReconstructedParticles"]:
+        assert summary[name]["n_match"] == summary[name]["n_plots"]
+
+
+def test_bara_progressive_matches_full_run(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, generate_events(n_events=300))
+    write_events(candidate, generate_events(n_events=300, differences={"MCParticles.mass": 0.1}, shuffle=True))
+
+    reports = {}
+    for name, options in [("full", []), ("progressive", ["--max-events", "20", "--progressive"])]:
+        (tmp_path / name).mkdir()
+        monkeypatch.chdir(tmp_path / name)
+        result = CliRunner().invoke(bara, [str(reference), str(candidate), "-j", "1", *options])
+        assert result.exit_code == 0, result.output
+        reports[name] = {
+            path.name: path.read_bytes()
+            for path in (tmp_path / name / "capybara-reports").iterdir()
+        }
+    assert reports["progressive"] == reports["full"]
+
+
+def test_bara_rntuple_clusters_match_ttree(tmp_path, monkeypatch):
+    events = generate_events(n_events=250)
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, events)
+    write_events(candidate, generate_events(n_events=250, shuffle=True), format="rntuple", cluster_size=40)
+
+    monkeypatch.chdir(tmp_path)
+    summary = bara.main([str(reference), str(candidate), "-j", "1", "--read-threads", "4"], standalone_mode=False)
+    assert sorted(summary) == ["EcalBarrelClusters", "EventHeader", "MCParticles", "ReconstructedParticles"]
+    for collection in summary.values():
+        assert collection["n_match"] == collection["n_plots"]
+
+
+def test_bara_sketch_size(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, generate_events(n_events=500))
+    write_events(candidate, generate_events(n_events=500, differences={"MCParticles.momentum.x": 0.5}, shuffle=True))
+
+    monkeypatch.chdir(tmp_path)
+    profiler = Profiler()
+    with activate(profiler):
+        # about 2500 values per leaf, compared from sketches of 64 values per level
+        summary = bara.main([str(reference), str(candidate), "-j", "1", "--sketch-size", "64"], standalone_mode=False)
+    assert "sketch" in profiler.phases
+    assert summary["MCParticles"]["ks_pvalue"] < 0.01
+    assert summary["MCParticles"]["n_match"] == summary["MCParticles"]["n_plots"] - 1
+
+
+def test_bara_profile_out(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, generate_events(n_events=100))
+    write_events(candidate, generate_events(n_events=100, differences={"MCParticles.mass": 1.0}, shuffle=True))
+
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(bara, [
+        str(reference), str(candidate), "-j", "1",
+        "--profile-out", str(tmp_path / "trace.json"), "--profile-top", "3",
+    ])
+    assert result.exit_code == 0, result.output
+
+    with open(tmp_path / "trace.json") as fp:
+        trace = json.load(fp)
+    event_names = {event["name"] for event in trace["traceEvents"]}
+    for name in ["open", "read", "sort", "histogram", "ks", "ad", "render", "write", "index", "MCParticles", "MCParticles.mass"]:
+        assert name in event_names
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace["traceEvents"])
+
+    phases = trace["otherData"]["phases"]
+    assert phases["read"]["count"] > 0
+    assert phases["read"]["bytes_read"] > 0
+    assert len(trace["otherData"]["slowest_leaves"]) == 3
+    assert len(trace["otherData"]["slowest_collections"]) == 3
+    walls = [stats["wall"] for _, stats in trace["otherData"]["slowest_leaves"]]
+    assert walls == sorted(walls, reverse=True)
+    assert "Slowest leaves:" in result.output
+
+
+def test_bara_sketch_matches_exact(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    candidate = tmp_path / "candidate.root"
+    write_events(reference, generate_events(n_events=600))
+    write_events(
+        candidate,
+        generate_events(n_events=600, differences={"MCParticles.momentum.x": 0.5}, shuffle=True),
+        format="rntuple", cluster_size=100,
+    )
+
+    monkeypatch.chdir(tmp_path)
+    for options in [[], ["--max-events", "100"]]:
+        exact = bara.main([str(reference), str(candidate), "-j", "1", *options], standalone_mode=False)
+        # sketches this large hold all values, read a cluster at a time
+        sketched = bara.main(
+            [str(reference), str(candidate), "-j", "1", "--sketch-size", "100000", "--read-threads", "2", *options],
+            standalone_mode=False,
+        )
+        assert sketched.keys() == exact.keys()
+        for name in exact:
+            assert sketched[name]["n_match"] == exact[name]["n_match"]
+            assert sketched[name]["ks_pvalue"] == exact[name]["ks_pvalue"]
+
+
+def test_bara_failure_cleans_up(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    write_events(reference, generate_events(n_events=50))
+
+    def render_collections(tasks, **kwargs):
+        yield "EcalBarrelClusters.json.gz", b"{}"
+        raise RuntimeError("rendering failed")
+
+    monkeypatch.chdir(tmp_path)
+    # epic_capybara.cli.bara is shadowed by the command
+    monkeypatch.setattr(sys.modules["epic_capybara.cli.bara"], "render_collections", render_collections)
+    closed = []
+    monkeypatch.setattr("uproot.reading.ReadOnlyFile.close", lambda self: closed.append(self.file_path))
+    with pytest.raises(RuntimeError):
+        bara.main([str(reference), str(reference), "--pack", "--read-threads", "2"], standalone_mode=False)
+    assert closed == [str(reference), str(reference)]
+    # the temporary pack file is removed
+    assert os.listdir(tmp_path / "capybara-reports") == []
+
+
+def test_bara_incremental_removes_stale_documents(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    collections = {"Hits": {"energy": "float32"}}
+    write_events(reference, generate_events(n_events=50, collections=collections))
+
+    monkeypatch.chdir(tmp_path)
+    bara.main([str(reference), str(reference), "--incremental", "-j", "1"], standalone_mode=False)
+    assert (tmp_path / "capybara-reports" / "Hits.json.gz").exists()
+
+    # without any hits, nothing can be histogrammed
+    write_events(reference, generate_events(n_events=50, collections=collections, multiplicity=0))
+    summary = bara.main([str(reference), str(reference), "--incremental", "-j", "1"], standalone_mode=False)
+    assert "Hits" not in summary
+    assert not (tmp_path / "capybara-reports" / "Hits.json.gz").exists()
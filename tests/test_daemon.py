@@ -0,0 +1,49 @@
+import stat
+import threading
+
+from epic_capybara.daemon import LRUCache, make_server, request
+from epic_capybara.synthetic import generate_events, write_events
+
+
+def test_daemon_reuses_reference(tmp_path):
+    reference = tmp_path / "reference.root"
+    write_events(reference, generate_events(n_events=100))
+    candidates = []
+    for ix in range(2):
+        candidate = tmp_path / f"candidate{ix}.root"
+        write_events(candidate, generate_events(n_events=100, differences={"MCParticles.mass": 1.0}))
+        candidates.append(candidate)
+
+    socket_path = tmp_path / "daemon.sock"
+    cache = LRUCache(max_bytes=2**30)
+    server = make_server(cache, socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+
+        for ix, candidate in enumerate(candidates):
+            job = {
+                "files": [str(reference), str(candidate)],
+                "output_dir": str(tmp_path / f"report{ix}"),
+                # rendering processes are spawned, not forked from the threaded server
+                "jobs": 2 if ix == 0 else 1,
+            }
+            status, reply = request("POST", "/jobs", job, socket_path=socket_path)
+            assert status == 200, reply
+            assert reply["summary"]["MCParticles"]["pvalue"] < 0.01
+            assert (tmp_path / f"report{ix}" / "index.html").exists()
+            if ix == 0:
+                misses = cache.misses
+        # only the second candidate was read by the second job
+        assert cache.misses - misses == misses // 2
+
+        status, reply = request("GET", "/status", socket_path=socket_path)
+        assert status == 200
+        assert reply["cache"]["hits"] > 0
+
+        status, reply = request("POST", "/jobs", {"files": []}, socket_path=socket_path)
+        assert status == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,7 +1,69 @@
 import doctest
+import sys
 
+import epic_capybara.cli.bara
+import epic_capybara.daemon
+import epic_capybara.filesystem
+import epic_capybara.incremental
+import epic_capybara.profiling
+import epic_capybara.publish
+import epic_capybara.render
+import epic_capybara.report
+import epic_capybara.serve
+import epic_capybara.sketch
+import epic_capybara.synthetic
+import epic_capybara.trend
 import epic_capybara.util
 
 def test_docstrings():
     doctest_results = doctest.testmod(m=epic_capybara.util)
     assert doctest_results.failed == 0
+
+def test_filesystem_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.filesystem)
+    assert doctest_results.failed == 0
+
+def test_publish_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.publish)
+    assert doctest_results.failed == 0
+
+def test_report_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.report)
+    assert doctest_results.failed == 0
+
+def test_render_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.render)
+    assert doctest_results.failed == 0
+
+def test_serve_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.serve)
+    assert doctest_results.failed == 0
+
+def test_incremental_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.incremental)
+    assert doctest_results.failed == 0
+
+def test_bara_docstrings():
+    # epic_capybara.cli.bara is shadowed by the command re-exported from epic_capybara.cli
+    doctest_results = doctest.testmod(m=sys.modules["epic_capybara.cli.bara"])
+    assert doctest_results.failed == 0
+
+def test_profiling_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.profiling)
+    assert doctest_results.failed == 0
+
+def test_sketch_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.sketch)
+    assert doctest_results.failed == 0
+
+def test_synthetic_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.synthetic)
+    assert doctest_results.failed == 0
+
+def test_daemon_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.daemon)
+    assert doctest_results.failed == 0
+
+def test_trend_docstrings():
+    doctest_results = doctest.testmod(m=epic_capybara.trend)
+    assert doctest_results.failed == 0
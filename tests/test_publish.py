@@ -0,0 +1,82 @@
+import hashlib
+import json
+import subprocess
+
+from epic_capybara.filesystem import hashdir
+from epic_capybara.publish import LINKS_FILENAME, publish_report
+
+
+def git(*args):
+    return subprocess.check_output(["git", *args], text=True)
+
+
+def test_publish_report_dedup(tmp_path, monkeypatch):
+    for var in ["AUTHOR", "COMMITTER"]:
+        monkeypatch.setenv(f"GIT_{var}_NAME", "capybara")
+        monkeypatch.setenv(f"GIT_{var}_EMAIL", "capybara@localhost")
+
+    remote = tmp_path / "remote.git"
+    git("init", "--quiet", "--bare", str(remote))
+    # required for partial clones over file://
+    git("-C", str(remote), "config", "uploadpack.allowFilter", "true")
+    remote_url = remote.as_uri()
+
+    report_1 = tmp_path / "report_1"
+    report_1.mkdir()
+    (report_1 / "index.html").write_text("<html>1</html>")
+    (report_1 / "A.json.gz").write_bytes(b"shared")
+    (report_1 / "B.json.gz").write_bytes(b"old")
+    new_blobs = publish_report(report_1, remote_url, "prefix1")
+    assert len(new_blobs) == 2
+
+    report_2 = tmp_path / "report_2"
+    report_2.mkdir()
+    (report_2 / "index.html").write_text("<html>2</html>")
+    (report_2 / "A.json.gz").write_bytes(b"shared")
+    (report_2 / "B.json.gz").write_bytes(b"new")
+    # blobs of earlier reports must not be fetched from the promisor remote
+    trace = tmp_path / "trace.json"
+    monkeypatch.setenv("GIT_NO_LAZY_FETCH", "1")
+    monkeypatch.setenv("GIT_TRACE2_EVENT", str(trace))
+    new_blobs = publish_report(report_2, remote_url, "prefix2")
+    monkeypatch.delenv("GIT_TRACE2_EVENT")
+    assert len(new_blobs) == 1
+    child_commands = [
+        event["argv"]
+        for event in map(json.loads, trace.read_text().splitlines())
+        if event["event"] == "child_start"
+    ]
+    assert not any("fetch" in argv for argv in child_commands), child_commands
+
+    files = git("-C", str(remote), "ls-tree", "-r", "--name-only", "HEAD").splitlines()
+    assert sum(path.startswith("blobs/") for path in files) == 3
+    assert "prefix1/index.html" in files
+    assert "prefix2/index.html" in files
+    assert git("-C", str(remote), "rev-list", "--count", "HEAD").strip() == "2"
+
+    links = json.loads(git("-C", str(remote), "show", f"HEAD:prefix2/{LINKS_FILENAME}"))
+    assert set(links) == {"A.json.gz", "B.json.gz"}
+    blob = links["B.json.gz"][len("../"):]
+    assert git("-C", str(remote), "show", f"HEAD:{blob}") == "new"
+
+
+def test_publish_report_hash_algorithm(tmp_path, monkeypatch):
+    for var in ["AUTHOR", "COMMITTER"]:
+        monkeypatch.setenv(f"GIT_{var}_NAME", "capybara")
+        monkeypatch.setenv(f"GIT_{var}_EMAIL", "capybara@localhost")
+
+    remote = tmp_path / "remote.git"
+    git("init", "--quiet", "--bare", str(remote))
+    git("-C", str(remote), "config", "uploadpack.allowFilter", "true")
+
+    report = tmp_path / "report"
+    report.mkdir()
+    (report / "A.json.gz").write_bytes(b"a")
+    (report / "B.json.gz").write_bytes(b"b")
+    file_digests = {}
+    prefix = hashdir(report, algorithm="sha256", file_digests=file_digests)
+    # digests computed by hashdir are not computed again
+    file_digests["A.json.gz"] = "ab" * 32
+    new_blobs = publish_report(report, remote.as_uri(), prefix, algorithm="sha256", file_digests=file_digests)
+    digest_b = hashlib.sha256(b"b").hexdigest()
+    assert set(new_blobs) == {f"blobs/ab/{'ab' * 32}.json.gz", f"blobs/{digest_b[:2]}/{digest_b}.json.gz"}
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import epic_capybara.render
+from epic_capybara.render import render_collection
+
+
+def _task(collection_name):
+    plot = {
+        "key": f"{collection_name}.energy",
+        "x_range": 10.0,
+        "series": [
+            (0, np.array([1, 4, 2, 2]), "reference"),
+            (1, np.array([1, 3, 3, 3]), "candidate"),
+        ],
+        "x": np.array([0.0, 1.0, 2.0, 3.0]),
+        "x_bounds": (-0.5, 10.5),
+        "y_bounds": (-0.2, 4.2),
+    }
+    return (collection_name, collection_name, [plot], "gzip", None)
+
+
+def test_render_collection_reproducible():
+    first = render_collection(_task("EcalBarrelClusters"))
+    # models built in between must not shift the IDs of later documents
+    render_collection(_task("MCParticles"))
+    second = render_collection(_task("EcalBarrelClusters"))
+    assert first == second
+
+
+def test_render_collection_without_bokeh_internals(monkeypatch):
+    # a Bokeh release without the ID counter internals
+    monkeypatch.setattr(epic_capybara.render, "bokeh_serialization", SimpleNamespace())
+    with pytest.warns(UserWarning, match="Unsupported Bokeh version"):
+        filename, data = render_collection(_task("MCParticles"))
+    assert filename == "MCParticles.json.gz"
+    assert data
@@ -0,0 +1,68 @@
+import gzip
+import http.client
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from epic_capybara.serve import ReportRequestHandler
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "index.html").write_text("<html></html>")
+    (tmp_path / "A.json.gz").write_bytes(gzip.compress(b"{}"))
+    (tmp_path / "capybara-reports.pack").write_bytes(b"0123456789")
+    handler = partial(ReportRequestHandler, directory=str(tmp_path))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(address, path, headers={}):
+    connection = http.client.HTTPConnection(*address)
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_content_encoding(server):
+    response, body = request(server, "/A.json.gz", {"Accept-Encoding": "gzip"})
+    assert response.status == 200
+    assert response.getheader("Content-Encoding") == "gzip"
+    assert gzip.decompress(body) == b"{}"
+
+    response, body = request(server, "/A.json.gz")
+    assert response.getheader("Content-Encoding") is None
+
+
+def test_conditional(server):
+    response, _ = request(server, "/")
+    assert response.status == 200
+    assert response.getheader("Cache-Control") == "no-cache"
+    etag = response.getheader("ETag")
+    assert etag.startswith('"')
+
+    response, body = request(server, "/index.html", {"If-None-Match": etag})
+    assert response.status == 304
+    assert body == b""
+
+
+def test_range(server):
+    response, body = request(server, "/capybara-reports.pack", {"Range": "bytes=2-4"})
+    assert response.status == 206
+    assert response.getheader("Content-Range") == "bytes 2-4/10"
+    assert body == b"234"
+
+    response, body = request(server, "/capybara-reports.pack", {"Range": "bytes=2-4", "If-Range": '"stale"'})
+    assert response.status == 200
+    assert body == b"0123456789"
+
+    response, _ = request(server, "/capybara-reports.pack", {"Range": "bytes=10-"})
+    assert response.status == 416
@@ -0,0 +1,37 @@
+from click.testing import CliRunner
+
+from epic_capybara.cli.bara import bara
+from epic_capybara.cli.trend import trend
+from epic_capybara.synthetic import generate_events, write_events
+from epic_capybara.trend import TrendStore
+
+
+def test_bara_trend_db(tmp_path, monkeypatch):
+    reference = tmp_path / "reference.root"
+    write_events(reference, generate_events(n_events=100))
+    database = tmp_path / "trend.sqlite"
+
+    monkeypatch.chdir(tmp_path)
+    for commit, shift in [("aaaa", 0.0), ("bbbb", 1.0)]:
+        candidate = tmp_path / commit / "rec.root"
+        candidate.parent.mkdir()
+        write_events(candidate, generate_events(n_events=100, differences={"MCParticles.mass": shift}))
+        result = CliRunner().invoke(bara, [
+            str(reference), str(candidate), "-j", "1",
+            "--trend-db", str(database), "--trend-commit", commit,
+        ])
+        assert result.exit_code == 0, result.output
+
+    store = TrendStore(str(database))
+    rows = store.history("rec.root", "MCParticles.mass")
+    store.close()
+    assert [row["commit_sha"] for row in rows] == ["aaaa", "bbbb"]
+    assert rows[0]["pvalue"] is None
+    assert rows[1]["pvalue"] < 0.01
+    assert abs(rows[1]["mean"] - rows[0]["mean"] - 1.0) < 1e-9
+    assert rows[1]["counts"].sum() == rows[1]["entries"]
+
+    result = CliRunner().invoke(trend, [str(database), "MCParticles.mass", "-o", str(tmp_path / "trend.html")])
+    assert result.exit_code == 0, result.output
+    assert "bbbb" in result.output
+    assert (tmp_path / "trend.html").exists()